@@ -0,0 +1,136 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.db.models import BigIntegerField, F, Max
+from django.db.models.functions import Cast, Coalesce, Round
+from django.utils import timezone
+from .ledger import balance_as_of
+from .models import Transaction, Wallet
+
+ANALYTICS_CACHE_TIMEOUT = 600
+ANALYTICS_CHUNK_SIZE = 5000
+DEFAULT_TOP_COUNTERPARTIES = 10
+MAX_TOP_COUNTERPARTIES = 100
+
+CENTS = Decimal('0.01')
+
+
+def _money(cents):
+    return str(Decimal(int(cents)) * CENTS)
+
+
+def _day_bounds(start_date, end_date):
+    start = timezone.make_aware(datetime.combine(start_date, time.min)) if start_date else None
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min)) if end_date else None
+    return start, end
+
+
+def _columns(queryset):
+    import numpy as np
+    import pandas as pd
+
+    # Amounts are summed as integer cents so the vectorized maths stays exact.
+    rows = queryset.annotate(
+        cents=Cast(Round(F('amount') * 100), BigIntegerField()),
+        sender_pk=Coalesce('sender', 0),
+        receiver_pk=Coalesce('receiver', 0),
+    ).order_by('timestamp', 'id').values_list('timestamp', 'transaction_type', 'cents', 'sender_pk', 'receiver_pk')
+    rows = list(rows.iterator(chunk_size=ANALYTICS_CHUNK_SIZE))
+    timestamps, types, cents, senders, receivers = zip(*rows) if rows else ((),) * 5
+    return (
+        pd.DatetimeIndex(pd.to_datetime(list(timestamps), utc=True)),
+        np.array(types, dtype=object),
+        np.array(cents, dtype=np.int64),
+        np.array(senders, dtype=np.int64),
+        np.array(receivers, dtype=np.int64),
+    )
+
+
+def _compute(wallet, start, end, top, opening_cents):
+    import numpy as np
+    import pandas as pd
+
+    queryset = Transaction.objects.filter(wallet=wallet)
+    if start is not None:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end is not None:
+        queryset = queryset.filter(timestamp__lt=end)
+    timestamps, types, cents, senders, receivers = _columns(queryset)
+
+    is_outflow = types == 'transfer'
+    signed = np.where(is_outflow, -cents, cents)
+    counterparty = np.where(is_outflow, receivers, np.where(types == 'receive', senders, 0))
+
+    days = timestamps.tz_convert(timezone.get_current_timezone()).normalize()
+    frame = pd.DataFrame({
+        'day': days,
+        'inflow': np.where(is_outflow, 0, cents),
+        'outflow': np.where(is_outflow, cents, 0),
+        'net': signed,
+    })
+    daily = frame.groupby('day', sort=True)[['inflow', 'outflow', 'net']].sum()
+    daily['balance'] = opening_cents + daily['net'].cumsum()
+
+    peers = pd.DataFrame({
+        'counterparty': counterparty,
+        'sent': np.where(is_outflow, cents, 0),
+        'received': np.where(is_outflow, 0, cents),
+    })
+    peers = peers[peers['counterparty'] != 0].groupby('counterparty').agg(
+        sent=('sent', 'sum'), received=('received', 'sum'), transactions=('sent', 'size'),
+    )
+    peers['volume'] = peers['sent'] + peers['received']
+    peers = peers.sort_values(['volume', 'transactions'], ascending=False).head(top)
+
+    wallets = {
+        pk: (address, username)
+        for pk, address, username in Wallet.objects.filter(pk__in=peers.index.tolist())
+        .values_list('pk', 'address', 'user__username')
+    }
+    closing_cents = opening_cents + int(signed.sum())
+    return {
+        "opening_balance": _money(opening_cents),
+        "closing_balance": _money(closing_cents),
+        "total_inflow": _money(daily['inflow'].sum()),
+        "total_outflow": _money(daily['outflow'].sum()),
+        "transaction_count": len(cents),
+        "daily": [
+            {
+                "date": day.date().isoformat(),
+                "inflow": _money(row.inflow),
+                "outflow": _money(row.outflow),
+                "net": _money(row.net),
+                "balance": _money(row.balance),
+            }
+            for day, row in zip(daily.index, daily.itertuples(index=False))
+        ],
+        "top_counterparties": [
+            {
+                "wallet_address": str(wallets[pk][0]) if pk in wallets else None,
+                "username": wallets[pk][1] if pk in wallets else None,
+                "sent": _money(row.sent),
+                "received": _money(row.received),
+                "transactions": int(row.transactions),
+            }
+            for pk, row in zip(peers.index.tolist(), peers.itertuples(index=False))
+        ],
+    }
+
+
+def wallet_analytics(wallet, start_date=None, end_date=None, top=DEFAULT_TOP_COUNTERPARTIES):
+    # Any new transaction on the wallet changes last_tx_id, so cached results
+    # never need explicit invalidation.
+    last_tx_id = Transaction.objects.filter(wallet=wallet).aggregate(last=Max('id'))['last'] or 0
+    key = f'analytics:{wallet.pk}:{start_date}:{end_date}:{top}:{last_tx_id}'
+    result = cache.get(key)
+    if result is None:
+        start, end = _day_bounds(start_date, end_date)
+        opening = balance_as_of(wallet, start - timedelta(microseconds=1)) if start is not None else Decimal('0')
+        result = _compute(wallet, start, end, top, int(opening / CENTS))
+        cache.set(key, result, ANALYTICS_CACHE_TIMEOUT)
+    return {
+        "wallet_address": str(wallet.address),
+        "start_date": start_date,
+        "end_date": end_date,
+        **result,
+    }
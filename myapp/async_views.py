@@ -0,0 +1,210 @@
+import asyncio
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.serializers import TokenObtainSerializer
+from .authentication import aauthenticate
+from .backends import PooledModelBackend
+from .caching import aget_wallet_snapshot
+from .conversations import aconversation_list
+from .filters import TransactionFilter
+from .models import Transaction, Wallet
+from .pagination import KeysetPagination
+from .realtime import get_broker, transaction_event, user_topic
+from .serializers import TransactionSerializer
+from .tokens import WalletRefreshToken
+
+SSE_HEARTBEAT_SECONDS = 15
+LONG_POLL_TIMEOUT = 25
+MAX_LONG_POLL_TIMEOUT = 60
+CATCH_UP_LIMIT = 100
+
+
+def _unauthorized():
+    return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+
+async def _authenticated_get(request):
+    if request.method != 'GET':
+        return None, HttpResponseNotAllowed(['GET'])
+    user = await aauthenticate(request)
+    if user is None:
+        return None, _unauthorized()
+    return user, None
+
+
+async def check_balance(request):
+    user, error = await _authenticated_get(request)
+    if error:
+        return error
+    wallet = await aget_wallet_snapshot(user.pk)
+    if wallet is None:
+        return JsonResponse({"error": "Wallet not found."}, status=404)
+    return JsonResponse({"balance": str(wallet['balance'])})
+
+
+async def wallet_address(request):
+    user, error = await _authenticated_get(request)
+    if error:
+        return error
+    # Tokens issued with wallet claims already carry the address.
+    if User.wallet.related.is_cached(user):
+        return JsonResponse({"wallet_address": str(user.wallet.address)})
+    wallet = await aget_wallet_snapshot(user.pk)
+    if wallet is None:
+        return JsonResponse({"error": "Wallet not found."}, status=404)
+    return JsonResponse({"wallet_address": str(wallet['address'])})
+
+
+async def transaction_list(request):
+    user, error = await _authenticated_get(request)
+    if error:
+        return error
+
+    queryset = Transaction.objects.filter(wallet__user=user).select_related('sender__user', 'receiver__user')
+    filterset = TransactionFilter(request.GET, queryset=queryset)
+    if not filterset.is_valid():
+        return JsonResponse(filterset.errors, status=400)
+
+    paginator = KeysetPagination()
+    try:
+        page = await paginator.apaginate_queryset(filterset.qs, request)
+    except NotFound as e:
+        return JsonResponse({"detail": str(e.detail)}, status=404)
+    data = TransactionSerializer(page, many=True).data
+    return JsonResponse(paginator.get_paginated_data(data), encoder=JSONEncoder)
+
+
+async def chat_list(request):
+    user, error = await _authenticated_get(request)
+    if error:
+        return error
+    return JsonResponse(await aconversation_list(user), safe=False, encoder=JSONEncoder)
+
+
+async def token_obtain_pair(request):
+    # Async counterpart of CustomTokenObtainPairView: the password check is
+    # awaited on the verification pool, so concurrent logins do not queue on
+    # the single thread sync views share under ASGI.
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if request.content_type != 'application/json':
+        return JsonResponse({"error": "Content-Type must be application/json"}, status=400)
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"detail": "JSON parse error."}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({"detail": "Invalid data."}, status=400)
+
+    missing = {
+        field: ["This field is required."]
+        for field in (User.USERNAME_FIELD, 'password') if not isinstance(data.get(field), str) or not data[field]
+    }
+    if missing:
+        return JsonResponse(missing, status=400)
+
+    user = await PooledModelBackend().aauthenticate(
+        request, username=data[User.USERNAME_FIELD], password=data['password'],
+    )
+    if user is None:
+        detail = TokenObtainSerializer.default_error_messages['no_active_account']
+        return JsonResponse({"detail": str(detail)}, status=401)
+
+    # Cached on the user, missing or not, so the token's wallet claims need
+    # no sync query.
+    User.wallet.related.set_cached_value(user, await Wallet.objects.filter(user=user).afirst())
+    refresh = WalletRefreshToken.for_user(user)
+    return JsonResponse({"refresh": str(refresh), "access": str(refresh.access_token)})
+
+
+async def _missed_events(user, since):
+    # Replays rows written while the client was disconnected, so a reconnect
+    # with Last-Event-ID (or ?since=) never drops a transaction.
+    if since is None:
+        return []
+    rows = Transaction.objects.filter(wallet__user=user, id__gt=since).order_by('id').values_list(
+        'id', 'transaction_type', 'amount', 'timestamp', 'wallet__address', 'sender__address', 'receiver__address',
+    )[:CATCH_UP_LIMIT]
+    return [transaction_event(*row) async for row in rows]
+
+
+def _sse(event):
+    tx = event['transaction']
+    return f"id: {tx['id']}\nevent: {tx['transaction_type']}\ndata: {json.dumps(tx, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def _event_stream(user, since):
+    broker = get_broker()
+    topic = user_topic(user.pk)
+    # Subscribe before replaying missed rows so nothing falls in between.
+    queue = broker.subscribe(topic)
+    try:
+        yield ": connected\n\n"
+        last_id = since or 0
+        for event in await _missed_events(user, since):
+            last_id = event['transaction']['id']
+            yield _sse(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event['type'] != 'transaction' or event['transaction']['id'] <= last_id:
+                continue
+            last_id = event['transaction']['id']
+            yield _sse(event)
+    finally:
+        broker.unsubscribe(topic, queue)
+
+
+async def _long_poll(user, since, timeout):
+    broker = get_broker()
+    topic = user_topic(user.pk)
+    queue = broker.subscribe(topic)
+    try:
+        events = await _missed_events(user, since)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not events:
+            try:
+                event = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                return HttpResponse(status=204)
+            if event['type'] == 'transaction' and event['transaction']['id'] > (since or 0):
+                events.append(event)
+    finally:
+        broker.unsubscribe(topic, queue)
+    return JsonResponse({"events": [event['transaction'] for event in events]})
+
+
+async def wallet_events(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user = await aauthenticate(request)
+    if user is None:
+        return _unauthorized()
+
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        since = int(since) if since else None
+        timeout = min(float(request.GET.get('timeout', LONG_POLL_TIMEOUT)), MAX_LONG_POLL_TIMEOUT)
+    except ValueError:
+        return JsonResponse({"error": "Invalid since or timeout."}, status=400)
+
+    if request.GET.get('mode') == 'poll':
+        return await _long_poll(user, since, timeout)
+    if not isinstance(request, ASGIRequest):
+        # WSGI servers collect an async iterator into a list before sending
+        # anything, so an endless stream would hang the worker.
+        return JsonResponse({"error": "Event streams need an ASGI server, use mode=poll."}, status=501)
+
+    response = StreamingHttpResponse(_event_stream(user, since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
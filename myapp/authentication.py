@@ -0,0 +1,52 @@
+import uuid
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .models import ClaimsUser, Wallet
+from .tokens import WALLET_ADDRESS_CLAIM, WALLET_ID_CLAIM, ais_revoked, is_revoked
+
+
+def user_from_claims(validated_token):
+    # No query: the user row is loaded lazily on first use of a field other
+    # than the id, and the wallet comes with only its balance deferred.
+    user_id = validated_token[api_settings.USER_ID_CLAIM]
+    user = ClaimsUser.from_db(DEFAULT_DB_ALIAS, ['id'], [user_id])
+    wallet_id = validated_token.get(WALLET_ID_CLAIM)
+    address = validated_token.get(WALLET_ADDRESS_CLAIM)
+    if wallet_id is not None and address is not None:
+        user.wallet = Wallet.from_db(
+            DEFAULT_DB_ALIAS, ['id', 'user_id', 'address'], [wallet_id, user_id, uuid.UUID(address)],
+        )
+    return user
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    # Trusts the signed claims instead of loading the user on every request.
+    # Deactivating a user therefore needs their tokens revoked as well.
+    def get_user(self, validated_token):
+        if is_revoked(validated_token):
+            raise InvalidToken("Token has been revoked.")
+        try:
+            return user_from_claims(validated_token)
+        except (KeyError, ValueError):
+            raise InvalidToken("Token contained no recognizable user identification")
+
+
+async def aauthenticate(request):
+    # JWT authentication for plain async Django views, which DRF's
+    # authentication classes cannot serve without blocking the event loop.
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        return None
+    raw_token = authentication.get_raw_token(header)
+    if raw_token is None:
+        return None
+    try:
+        validated_token = authentication.get_validated_token(raw_token)
+        if await ais_revoked(validated_token):
+            return None
+        return user_from_claims(validated_token)
+    except (InvalidToken, TokenError, KeyError, ValueError):
+        return None
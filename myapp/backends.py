@@ -0,0 +1,81 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import make_password
+from .hashers import verify_password
+
+
+def _setup_worker():
+    django.setup()
+
+
+@lru_cache(maxsize=None)
+def verification_pool():
+    workers = getattr(settings, 'PASSWORD_VERIFY_WORKERS', 0)
+    if not workers:
+        return None
+    return ProcessPoolExecutor(max_workers=workers if workers > 0 else os.cpu_count(), initializer=_setup_worker)
+
+
+class PooledModelBackend(ModelBackend):
+    # ModelBackend that can run password verification in a process pool
+    # (PASSWORD_VERIFY_WORKERS > 0, or -1 for one per core). The request
+    # thread only waits on the result, so hashing does not hold the server's
+    # worker processes. Under ASGI, sync views share one thread, so
+    # authenticate() still serializes logins there; the async login view uses
+    # aauthenticate(), which awaits the pool from the event loop instead.
+    # Outdated hashes are upgraded with the new hash computed in the pool.
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        pool = verification_pool()
+        if pool is None:
+            return super().authenticate(request, username=username, password=password, **kwargs)
+
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Keep the timing of unknown usernames close to a failed check.
+            pool.submit(make_password, password).result()
+            return None
+
+        valid, upgraded = pool.submit(verify_password, password, user.password).result()
+        if not valid or not self.user_can_authenticate(user):
+            return None
+        if upgraded is not None:
+            user.password = upgraded
+            user.save(update_fields=['password'])
+        return user
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        pool = verification_pool()
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        try:
+            user = await UserModel._default_manager.aget(**{UserModel.USERNAME_FIELD: username})
+        except UserModel.DoesNotExist:
+            await loop.run_in_executor(pool, make_password, password)
+            return None
+
+        # Without a pool the default thread executor still keeps hashing off
+        # the event loop and the shared sync thread.
+        valid, upgraded = await loop.run_in_executor(pool, verify_password, password, user.password)
+        if not valid or not self.user_can_authenticate(user):
+            return None
+        if upgraded is not None:
+            user.password = upgraded
+            await user.asave(update_fields=['password'])
+        return user
@@ -0,0 +1,136 @@
+import threading
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from .models import Wallet
+
+WALLET_CACHE_TIMEOUT = 300
+
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'WALLET_CACHE_ALIAS', 'default')]
+
+
+def _count(name, hit):
+    with _counters_lock:
+        _counters[f'{name}_{"hits" if hit else "misses"}'] += 1
+
+
+def cache_stats():
+    with _counters_lock:
+        return dict(_counters)
+
+
+def _wallet_key(user_id):
+    return f'wallet:user:{user_id}'
+
+
+def _address_key(address):
+    return f'wallet:address:{address}'
+
+
+def _normalize_address(address):
+    try:
+        return uuid.UUID(str(address))
+    except (TypeError, ValueError):
+        return None
+
+
+def _user_from_entry(address, entry):
+    # A user with only the id and, when cached, the username loaded; everything
+    # else is deferred and fetched on first access. The wallet is attached with
+    # its balance deferred, so a cached address can never leak a stale balance.
+    if 'username' in entry:
+        user = User.from_db('default', ['id', 'username'], [entry['user_id'], entry['username']])
+    else:
+        user = User.from_db('default', ['id'], [entry['user_id']])
+    user.wallet = Wallet.from_db('default', ['id', 'user_id', 'address'], [entry['wallet_id'], entry['user_id'], address])
+    return user
+
+
+def _is_shared(cache):
+    # Only the process that wrote can invalidate a process-local cache, so
+    # with several workers the others would keep serving the old value.
+    # Balances and usernames are only cached in a shared backend.
+    return not isinstance(cache, LocMemCache)
+
+
+def _snapshot(user_id):
+    return Wallet.objects.filter(user_id=user_id).values('id', 'address', 'balance')
+
+
+# Balances are cached per user in a shared cache and dropped when a write
+# commits. Readers only add() entries, so a reader that raced a write can never
+# overwrite the invalidation of a newer value with an older one it fetched
+# earlier.
+def get_wallet_snapshot(user_id):
+    cache = _cache()
+    if not _is_shared(cache):
+        return _snapshot(user_id).first()
+    snapshot = cache.get(_wallet_key(user_id))
+    _count('wallet', snapshot is not None)
+    if snapshot is None:
+        snapshot = _snapshot(user_id).first()
+        if snapshot is not None:
+            cache.add(_wallet_key(user_id), snapshot, WALLET_CACHE_TIMEOUT)
+    return snapshot
+
+
+async def aget_wallet_snapshot(user_id):
+    cache = _cache()
+    if not _is_shared(cache):
+        return await _snapshot(user_id).afirst()
+    snapshot = await cache.aget(_wallet_key(user_id))
+    _count('wallet', snapshot is not None)
+    if snapshot is None:
+        snapshot = await _snapshot(user_id).afirst()
+        if snapshot is not None:
+            await cache.aadd(_wallet_key(user_id), snapshot, WALLET_CACHE_TIMEOUT)
+    return snapshot
+
+
+def get_user_by_address(address):
+    address = _normalize_address(address)
+    if address is None:
+        return None
+    cache = _cache()
+    entry = cache.get(_address_key(address))
+    _count('address', entry is not None)
+    if entry is None:
+        row = Wallet.objects.filter(address=address).values_list('id', 'user_id', 'user__username').first()
+        if row is None:
+            return None
+        # The ids behind an address never change; a username can, so it is
+        # left out of process-local caches and read fresh on first access.
+        entry = {'wallet_id': row[0], 'user_id': row[1]}
+        if _is_shared(cache):
+            entry['username'] = row[2]
+        cache.add(_address_key(address), entry, WALLET_CACHE_TIMEOUT)
+        return _user_from_entry(address, {**entry, 'username': row[2]})
+    return _user_from_entry(address, entry)
+
+
+def _delete(keys):
+    cache = _cache()
+    cache.delete_many(keys)
+    # Drop them again once the write is visible to other connections, in case
+    # a concurrent reader cached the pre-commit value in between.
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_wallets(*wallets):
+    _delete([_wallet_key(wallet.user_id) for wallet in wallets])
+
+
+def invalidate_user(user_id, address=None):
+    keys = [_wallet_key(user_id)]
+    if address is not None:
+        keys.append(_address_key(address))
+    _delete(keys)
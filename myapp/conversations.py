@@ -0,0 +1,173 @@
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, Case, CharField, Count, F, IntegerField, Q, Value, When, Window
+from django.db.models.functions import Greatest, Least, RowNumber
+from .models import Conversation, Message
+from .previews import schedule_previews
+from .realtime import publish
+from .serializers import MessageSerializer
+
+PREVIEW_LENGTH = 255
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def participants(first_id, second_id):
+    return (first_id, second_id) if first_id <= second_id else (second_id, first_id)
+
+
+def unread_field(low, reader_id):
+    return 'unread_low' if reader_id == low else 'unread_high'
+
+
+def _preview(message):
+    return (message.text or '')[:PREVIEW_LENGTH]
+
+
+def record_message(message):
+    low, high = participants(message.sender_id, message.receiver_id)
+    # Only move the last-message pointer forward, so concurrent senders that
+    # commit out of order cannot leave an older message on top.
+    is_newer = Q(last_timestamp__lte=message.timestamp)
+    updates = {
+        'last_message': Case(
+            When(is_newer, then=Value(message.pk)), default=F('last_message'), output_field=BigIntegerField(),
+        ),
+        'last_message_preview': Case(
+            When(is_newer, then=Value(_preview(message))), default=F('last_message_preview'), output_field=CharField(),
+        ),
+        'last_timestamp': Greatest(F('last_timestamp'), Value(message.timestamp)),
+    }
+    if message.sender_id != message.receiver_id and not message.is_read:
+        field = unread_field(low, message.receiver_id)
+        updates[field] = F(field) + 1
+
+    if Conversation.objects.filter(user_low_id=low, user_high_id=high).update(**updates):
+        return
+
+    unread = {}
+    if message.sender_id != message.receiver_id and not message.is_read:
+        unread[unread_field(low, message.receiver_id)] = 1
+    try:
+        with transaction.atomic():
+            Conversation.objects.create(
+                user_low_id=low,
+                user_high_id=high,
+                last_message=message,
+                last_message_preview=_preview(message),
+                last_timestamp=message.timestamp,
+                **unread,
+            )
+    except IntegrityError:
+        Conversation.objects.filter(user_low_id=low, user_high_id=high).update(**updates)
+
+
+def send_message(sender, receiver, **fields):
+    with transaction.atomic():
+        message = Message.objects.create(sender=sender, receiver=receiver, **fields)
+        record_message(message)
+        publish([sender.pk, receiver.pk], {"type": "message.new", "message": MessageSerializer(message).data})
+        if message.file:
+            schedule_previews(message)
+    return message
+
+
+def mark_conversation_read(reader, counterpart, count=None):
+    low, high = participants(reader.pk, counterpart.pk)
+    field = unread_field(low, reader.pk)
+    value = 0 if count is None else Greatest(F(field) - count, Value(0))
+    Conversation.objects.filter(user_low_id=low, user_high_id=high).update(**{field: value})
+
+
+def mark_messages_read(reader, counterpart, messages):
+    unread = [message for message in messages if message.receiver_id == reader.pk and not message.is_read]
+    if not unread:
+        return 0
+    updated = Message.objects.filter(id__in=[message.pk for message in unread], is_read=False).update(is_read=True)
+    for message in unread:
+        message.is_read = True
+    if updated:
+        mark_conversation_read(reader, counterpart, count=updated)
+        publish([counterpart.pk], {
+            "type": "message.read",
+            "reader_wallet_address": str(reader.wallet.address),
+            "message_ids": [message.pk for message in unread],
+        })
+    return updated
+
+
+def _user_conversations(user):
+    return Conversation.objects.filter(Q(user_low=user) | Q(user_high=user)) \
+        .select_related('user_low__wallet', 'user_high__wallet') \
+        .order_by('-last_timestamp')
+
+
+def _chat_entry(conversation, user):
+    if conversation.user_low_id == user.pk:
+        counterpart, unread_count = conversation.user_high, conversation.unread_low
+    else:
+        counterpart, unread_count = conversation.user_low, conversation.unread_high
+    return {
+        "wallet_address": counterpart.wallet.address,
+        "username": counterpart.username,
+        "last_message": conversation.last_message_preview,
+        "timestamp": conversation.last_timestamp,
+        "unread_count": unread_count,
+    }
+
+
+def conversation_list(user):
+    return [_chat_entry(conversation, user) for conversation in _user_conversations(user)]
+
+
+async def aconversation_list(user):
+    return [_chat_entry(conversation, user) async for conversation in _user_conversations(user)]
+
+
+def backfill_conversations(chunk_size=BACKFILL_CHUNK_SIZE):
+    pair = {
+        'low': Least('sender', 'receiver', output_field=IntegerField()),
+        'high': Greatest('sender', 'receiver', output_field=IntegerField()),
+    }
+    latest = Message.objects.annotate(**pair).annotate(
+        rank=Window(
+            RowNumber(),
+            partition_by=[F('low'), F('high')],
+            order_by=[F('timestamp').desc(), F('id').desc()],
+        ),
+    ).filter(rank=1).values_list('id', 'low', 'high', 'text', 'timestamp')
+
+    unread = {}
+    counts = Message.objects.filter(is_read=False).exclude(sender=F('receiver')) \
+        .values('sender', 'receiver').annotate(unread=Count('id')) \
+        .values_list('sender', 'receiver', 'unread')
+    for sender_id, receiver_id, count in counts:
+        low, high = participants(sender_id, receiver_id)
+        unread[(low, high, unread_field(low, receiver_id))] = count
+
+    def flush(batch):
+        Conversation.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['user_low', 'user_high'],
+            update_fields=['last_message', 'last_message_preview', 'last_timestamp', 'unread_low', 'unread_high'],
+        )
+
+    total = 0
+    batch = []
+    for message_id, low, high, text, timestamp in latest.iterator(chunk_size=chunk_size):
+        batch.append(Conversation(
+            user_low_id=low,
+            user_high_id=high,
+            last_message_id=message_id,
+            last_message_preview=(text or '')[:PREVIEW_LENGTH],
+            last_timestamp=timestamp,
+            unread_low=unread.get((low, high, 'unread_low'), 0),
+            unread_high=unread.get((low, high, 'unread_high'), 0),
+        ))
+        if len(batch) >= chunk_size:
+            flush(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        total += len(batch)
+    return total
@@ -0,0 +1,143 @@
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import content_disposition_header, parse_etags, quote_etag
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+DOWNLOAD_BLOCK_SIZE = 64 * 1024
+
+
+class RangeFile:
+    # Reads at most ``length`` bytes from ``start``. It deliberately has no
+    # fileno(), so WSGI servers iterate it instead of sendfile()-ing the
+    # whole file past the end of the range.
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def variant_file(message, variant=None):
+    # The attachment itself, or one of the previews rendered from it.
+    return message.file if variant is None else getattr(message, variant)
+
+
+def file_etag(message, variant=None):
+    if message.stored_file_id is not None:
+        # Previews of a deduplicated file are rendered from the same content.
+        sha256 = message.stored_file.sha256
+        return quote_etag(sha256 if variant is None else f'{sha256}-{variant}')
+    file = variant_file(message, variant)
+    storage = file.storage
+    modified = storage.get_modified_time(file.name).timestamp()
+    return f'W/"{storage.size(file.name)}-{int(modified)}"'
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    candidates = parse_etags(header)
+    # If-None-Match uses the weak comparison.
+    return '*' in candidates or etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in candidates]
+
+
+def _if_range_matches(header, etag):
+    # If-Range needs the strong comparison: a weak validator (or a date) never
+    # allows a partial response, so the client gets the whole file instead.
+    return not etag.startswith('W/') and header.strip() == etag
+
+
+def parse_range(header, size):
+    # Returns (start, end) for a single satisfiable byte range, None when the
+    # header should be ignored, or False when it cannot be satisfied.
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def _offload(file, file_name, content_type, as_attachment):
+    # The front-end server streams the file itself; Python never reads it.
+    mode = settings.FILE_DOWNLOAD_OFFLOAD
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'FILE_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + file.name
+    else:
+        response['X-Sendfile'] = file.path
+    response['Content-Disposition'] = content_disposition_header(as_attachment, file_name)
+    return response
+
+
+def file_response(request, message, variant=None):
+    # Previews are shown inline under the attachment's name; the attachment
+    # itself is always downloaded.
+    file = variant_file(message, variant)
+    file_name = message.file_name or os.path.basename(message.file.name)
+    if variant is not None:
+        file_name = f'{os.path.splitext(file_name)[0]}-{variant}{os.path.splitext(file.name)[1]}'
+    content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    as_attachment = variant is None
+    etag = file_etag(message, variant)
+
+    if _etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponse(status=304)
+    elif getattr(settings, 'FILE_DOWNLOAD_OFFLOAD', None):
+        response = _offload(file, file_name, content_type, as_attachment)
+    else:
+        size = message.stored_file.size if variant is None and message.stored_file_id is not None else file.size
+        response = _stream(request, file, size, file_name, content_type, as_attachment, etag)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return response
+
+
+def _stream(request, file, size, file_name, content_type, as_attachment, etag):
+    byte_range = parse_range(request.headers.get('Range'), size)
+    if_range = request.headers.get('If-Range')
+    if byte_range is not None and if_range and not _if_range_matches(if_range, etag):
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    opened = file.storage.open(file.name, 'rb')
+    if byte_range is None:
+        # A real file object, so servers with wsgi.file_wrapper can sendfile().
+        response = FileResponse(opened, as_attachment=as_attachment, filename=file_name, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(
+            RangeFile(opened, start, end - start + 1), as_attachment=as_attachment, filename=file_name,
+            content_type=content_type, status=206,
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response.block_size = DOWNLOAD_BLOCK_SIZE
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher, BCryptSHA256PasswordHasher, check_password, get_hasher, identify_hasher, make_password,
+)
+
+
+def hasher_options(algorithm):
+    return getattr(settings, 'PASSWORD_HASHER_OPTIONS', {}).get(algorithm, {})
+
+
+class TunableArgon2PasswordHasher(Argon2PasswordHasher):
+    # Costs come from PASSWORD_HASHER_OPTIONS['argon2']. Hashes stored with
+    # other costs report must_update(), so Django re-hashes them on login.
+    def __init__(self):
+        options = hasher_options(self.algorithm)
+        self.time_cost = options.get('time_cost', self.time_cost)
+        self.memory_cost = options.get('memory_cost', self.memory_cost)
+        self.parallelism = options.get('parallelism', self.parallelism)
+
+
+class TunableBCryptSHA256PasswordHasher(BCryptSHA256PasswordHasher):
+    def __init__(self):
+        self.rounds = hasher_options(self.algorithm).get('rounds', self.rounds)
+
+
+def needs_rehash(encoded):
+    # Mirrors the upgrade rule of AbstractBaseUser.check_password().
+    preferred = get_hasher('default')
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def verify_password(password, encoded):
+    # Runs in the verification pool: returns whether the password matched and,
+    # when the stored hash is outdated, its replacement.
+    if not check_password(password, encoded):
+        return False, None
+    return True, make_password(password) if needs_rehash(encoded) else None
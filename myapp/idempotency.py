@@ -0,0 +1,91 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+# Keys older than this are treated as new and removed by
+# ``manage.py purge_idempotency_keys``; clients must not retry for longer.
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+PURGE_BATCH_SIZE = 5000
+
+
+def expiry_cutoff():
+    return timezone.now() - IDEMPOTENCY_KEY_TTL
+
+
+def purge_expired_keys(batch_size=PURGE_BATCH_SIZE):
+    # Deletes in batches so a large backlog never holds long row locks.
+    cutoff = expiry_cutoff()
+    total = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return total
+        total += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+
+
+def request_hash(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    # Goes below @api_view so the wrapped view sees the authenticated DRF
+    # request. The key row is inserted in the same transaction as the write:
+    # a concurrent retry blocks on the unique index until the first attempt
+    # commits and then replays its stored response. Failed attempts roll the
+    # key back, so they can be retried with the same key. An expired key is
+    # dropped first, so its next use runs as a new request.
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return Response(
+                {"error": f"{IDEMPOTENCY_HEADER} must be at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_hash(request)
+        with transaction.atomic():
+            IdempotencyKey.objects.filter(user=request.user, key=key, created_at__lt=expiry_cutoff()).delete()
+            record, created = IdempotencyKey.objects.get_or_create(
+                user=request.user, key=key, defaults={'request_hash': fingerprint},
+            )
+            if not created:
+                if record.request_hash != fingerprint:
+                    return Response(
+                        {"error": f"{IDEMPOTENCY_HEADER} was already used for a different request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                return _replay(record)
+
+            response = view(request, *args, **kwargs)
+            if not status.is_success(response.status_code):
+                transaction.set_rollback(True)
+                return response
+
+            record.response_status = response.status_code
+            record.response_body = response.data
+            record.save(update_fields=['response_status', 'response_body'])
+        return response
+
+    return wrapper
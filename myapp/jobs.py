@@ -0,0 +1,88 @@
+import logging
+import signal
+import threading
+import traceback
+from datetime import timedelta
+from django.db import DatabaseError, close_old_connections, connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_POLL_INTERVAL = 1.0
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+JOB_MAX_RETRY_DELAY = 3600
+
+
+def job_name(handler):
+    return f'{handler.__module__}.{handler.__qualname__}'
+
+
+def enqueue(handler, max_attempts=JOB_MAX_ATTEMPTS, **payload):
+    # The row is written in the caller's transaction, so workers see it
+    # exactly when the write commits and it disappears with a rollback. The
+    # handler must be a module-level function and the payload JSON.
+    return Job.objects.create(name=job_name(handler), payload=payload, max_attempts=max_attempts)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(JOB_RETRY_DELAY * 2 ** (attempts - 1), JOB_MAX_RETRY_DELAY))
+
+
+def run_next():
+    # Claims one due job and runs it inside the claiming transaction: the row
+    # lock keeps other workers off it, and a handler's database writes commit
+    # together with the job's removal. If the worker dies the lock goes with
+    # it and the job is picked up again.
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True) \
+            .filter(status='queued', run_at__lte=timezone.now()).order_by('run_at', 'id').first()
+        if job is None:
+            return None
+        try:
+            with transaction.atomic():
+                import_string(job.name)(**job.payload)
+        except Exception:
+            logger.exception("Job %s (%s) failed", job.pk, job.name)
+            job.attempts += 1
+            job.last_error = traceback.format_exc()
+            if job.attempts >= job.max_attempts:
+                job.status = 'failed'
+            else:
+                job.run_at = timezone.now() + retry_delay(job.attempts)
+            job.save(update_fields=['attempts', 'last_error', 'status', 'run_at'])
+        else:
+            job.delete()
+    return job
+
+
+def work(stop, poll_interval=JOB_POLL_INTERVAL, burst=False):
+    # Runs jobs until stop is set, sleeping while the queue is empty. In burst
+    # mode it returns as soon as nothing is due.
+    processed = 0
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            job = run_next()
+        except DatabaseError:
+            logger.exception("Claiming a job failed")
+            job = None
+        if job is not None:
+            processed += 1
+        elif burst:
+            break
+        else:
+            stop.wait(poll_interval)
+    connections.close_all()
+    return processed
+
+
+def worker_main(poll_interval=JOB_POLL_INTERVAL, burst=False):
+    # Entry point of a worker process. SIGTERM and SIGINT let the current job
+    # finish before the process exits.
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    return work(stop, poll_interval, burst)
@@ -0,0 +1,112 @@
+from decimal import Decimal
+from django.db.models import Count, DecimalField, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import BalanceCheckpoint, LedgerEntry, Wallet
+
+LEDGER_CHECKPOINT_INTERVAL = 100
+RECONCILE_CHUNK_SIZE = 1000
+
+
+def ledger_entries(transactions):
+    entries = []
+    for tx in transactions:
+        if tx.transaction_type == 'deposit':
+            legs = [(tx.wallet_id, tx.amount), (None, -tx.amount)]
+        elif tx.transaction_type == 'transfer':
+            legs = [(tx.wallet_id, -tx.amount)]
+        else:
+            legs = [(tx.wallet_id, tx.amount)]
+        entries.extend(
+            LedgerEntry(
+                wallet_id=wallet_id,
+                transaction_id=tx.pk,
+                entry_type=tx.transaction_type,
+                amount=amount,
+                timestamp=tx.timestamp,
+            )
+            for wallet_id, amount in legs
+        )
+    return entries
+
+
+def post_transactions(transactions):
+    # Called inside the transaction that moved the money, while the wallets
+    # are still locked, so each wallet's entries are in id and time order.
+    return LedgerEntry.objects.bulk_create(ledger_entries(transactions))
+
+
+def balance_as_of(wallet, at):
+    checkpoint = BalanceCheckpoint.objects.filter(wallet=wallet, timestamp__lte=at).order_by('-entry_id').first()
+    tail = LedgerEntry.objects.filter(wallet=wallet, timestamp__lte=at)
+    balance = Decimal('0.00')
+    if checkpoint is not None:
+        tail = tail.filter(id__gt=checkpoint.entry_id)
+        balance = checkpoint.balance
+    return balance + (tail.aggregate(total=Sum('amount'))['total'] or 0)
+
+
+def _ledger_balances(wallets, full=False):
+    amount = DecimalField(max_digits=15, decimal_places=2)
+    entries = LedgerEntry.objects.filter(wallet=OuterRef('pk')).order_by().values('wallet')
+    if not full:
+        checkpoints = BalanceCheckpoint.objects.filter(wallet=OuterRef('pk')).order_by('-entry_id')
+        wallets = wallets.annotate(
+            checkpoint_entry=Coalesce(Subquery(checkpoints.values('entry_id')[:1]), Value(0)),
+            checkpoint_balance=Coalesce(Subquery(checkpoints.values('balance')[:1]), Value(0), output_field=amount),
+        )
+        entries = entries.filter(id__gt=OuterRef('checkpoint_entry'))
+    else:
+        wallets = wallets.annotate(
+            checkpoint_entry=Value(0, output_field=IntegerField()),
+            checkpoint_balance=Value(Decimal('0'), output_field=amount),
+        )
+    # One statement per chunk, so the stored balances and the ledger are read
+    # from the same snapshot even under READ COMMITTED.
+    return wallets.annotate(
+        tail_total=Coalesce(Subquery(entries.annotate(total=Sum('amount')).values('total')), Value(0), output_field=amount),
+        tail_count=Coalesce(Subquery(entries.annotate(count=Count('id')).values('count')), Value(0)),
+        last_entry=Subquery(entries.annotate(last=Max('id')).values('last')),
+        last_timestamp=Subquery(entries.annotate(last=Max('timestamp')).values('last')),
+    ).values_list(
+        'id', 'address', 'balance', 'checkpoint_balance', 'tail_total', 'tail_count', 'last_entry', 'last_timestamp',
+    )
+
+
+def reconcile_chunk(first_id, last_id, full=False, checkpoint_interval=LEDGER_CHECKPOINT_INTERVAL):
+    drift = []
+    checkpoints = []
+    wallets = Wallet.objects.filter(id__gte=first_id, id__lte=last_id).order_by('id')
+    for wallet_id, address, balance, base, tail, count, last_entry, last_timestamp in _ledger_balances(wallets, full):
+        ledger_balance = base + tail
+        if ledger_balance != balance:
+            drift.append({
+                "wallet_id": wallet_id,
+                "wallet_address": str(address),
+                "balance": balance,
+                "ledger_balance": ledger_balance,
+                "difference": balance - ledger_balance,
+            })
+        elif count >= checkpoint_interval:
+            checkpoints.append(BalanceCheckpoint(
+                wallet_id=wallet_id, entry_id=last_entry, balance=ledger_balance, timestamp=last_timestamp,
+            ))
+    # Only wallets that agree with their ledger get a checkpoint, so a later
+    # incremental run still compares drifted wallets against their history.
+    BalanceCheckpoint.objects.bulk_create(checkpoints, ignore_conflicts=True)
+    return drift, len(checkpoints)
+
+
+def wallet_chunks(chunk_size=RECONCILE_CHUNK_SIZE):
+    ids = Wallet.objects.order_by('id').values_list('id', flat=True)
+    chunk = []
+    for wallet_id in ids.iterator(chunk_size=chunk_size):
+        chunk.append(wallet_id)
+        if len(chunk) >= chunk_size:
+            yield chunk[0], chunk[-1]
+            chunk = []
+    if chunk:
+        yield chunk[0], chunk[-1]
+
+
+def ledger_imbalance():
+    return LedgerEntry.objects.aggregate(total=Sum('amount'))['total'] or Decimal('0')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from myapp.conversations import BACKFILL_CHUNK_SIZE, backfill_conversations
+
+
+class Command(BaseCommand):
+    help = "Build or refresh the Conversation table from existing messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        total = backfill_conversations(chunk_size=options['chunk_size'])
+        self.stdout.write(f"Backfilled {total} conversations.")
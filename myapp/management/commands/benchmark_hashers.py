@@ -0,0 +1,93 @@
+import time
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import get_hasher, get_hashers
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+BENCHMARK_PASSWORD = 'correct horse battery staple'
+
+
+def _timed(function, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations
+
+
+def _cost(hasher):
+    if hasattr(hasher, 'time_cost'):
+        return f"time_cost={hasher.time_cost} memory_cost={hasher.memory_cost} parallelism={hasher.parallelism}"
+    if hasattr(hasher, 'rounds'):
+        return f"rounds={hasher.rounds}"
+    if hasattr(hasher, 'iterations'):
+        return f"iterations={hasher.iterations}"
+    return ", ".join(f"{key}={value}" for key, value in vars(hasher).items()) or "-"
+
+
+class Command(BaseCommand):
+    help = "Measure password hashing and login cost per core for the configured hashers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--hasher', action='append', help="Algorithm to measure; repeatable. Defaults to all.")
+        parser.add_argument(
+            '--target-ms', type=float,
+            help="Latency budget for one verification; suggests the cost that fits it.",
+        )
+        parser.add_argument(
+            '--logins', action='store_true',
+            help="Also time full authenticate() calls for a throwaway user with the default hasher.",
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        hashers = get_hashers()
+        if options['hasher']:
+            hashers = [hasher for hasher in hashers if hasher.algorithm in options['hasher']]
+            if not hashers:
+                raise CommandError("None of the requested hashers is in PASSWORD_HASHERS.")
+
+        for hasher in hashers:
+            salt = hasher.salt()
+            encoded = hasher.encode(BENCHMARK_PASSWORD, salt)
+            encode = _timed(lambda: hasher.encode(BENCHMARK_PASSWORD, salt), iterations)
+            verify = _timed(lambda: hasher.verify(BENCHMARK_PASSWORD, encoded), iterations)
+            self.stdout.write(
+                f"{hasher.algorithm:<16} {_cost(hasher):<48} encode {encode * 1000:8.1f} ms  "
+                f"verify {verify * 1000:8.1f} ms  {1 / verify:8.1f} logins/s per core"
+            )
+            if options['target_ms']:
+                self.stdout.write(f"{'':<16} suggested for {options['target_ms']:g} ms: {self.suggest(hasher, verify, options['target_ms'])}")
+
+        if options['logins']:
+            self.benchmark_logins(iterations)
+
+    def suggest(self, hasher, verify, target_ms):
+        target = target_ms / 1000
+        if hasattr(hasher, 'time_cost'):
+            # Argon2 cost grows linearly with time_cost at a fixed memory cost.
+            return f"time_cost={max(1, int(hasher.time_cost * target / verify))}"
+        if hasattr(hasher, 'rounds'):
+            # Each bcrypt round doubles the cost.
+            rounds = hasher.rounds
+            while verify * 2 <= target:
+                verify, rounds = verify * 2, rounds + 1
+            while verify > target and rounds > 4:
+                verify, rounds = verify / 2, rounds - 1
+            return f"rounds={rounds}"
+        if hasattr(hasher, 'iterations'):
+            return f"iterations={max(1, int(hasher.iterations * target / verify))}"
+        return "n/a"
+
+    def benchmark_logins(self, iterations):
+        User = get_user_model()
+        with transaction.atomic():
+            user = User.objects.create_user(username=f'benchmark-{time.time_ns()}', password=BENCHMARK_PASSWORD)
+            # The first login may upgrade the hash; measure the steady state.
+            authenticate(username=user.username, password=BENCHMARK_PASSWORD)
+            elapsed = _timed(lambda: authenticate(username=user.username, password=BENCHMARK_PASSWORD), iterations)
+            transaction.set_rollback(True)
+        self.stdout.write(
+            f"authenticate() with {get_hasher('default').algorithm}: {elapsed * 1000:.1f} ms, "
+            f"{1 / elapsed:.1f} logins/s per core"
+        )
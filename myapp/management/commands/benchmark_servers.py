@@ -0,0 +1,147 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from wsgiref.util import setup_testing_defaults
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import include, path, reverse
+from myapp.models import Transaction
+from myapp.tokens import WalletRefreshToken
+from myapp.urls import async_read_views, sync_urlpatterns, with_async_views
+
+BENCHMARK_HOST = 'localhost'
+
+
+def _urlconf(name, patterns):
+    module = ModuleType(name)
+    module.urlpatterns = [path('api/', include(patterns))]
+    return module
+
+
+def _report(latencies, elapsed):
+    latencies = sorted(latencies)
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return (
+        f"{len(latencies) / elapsed:8.0f} req/s  p50 {percentiles[49] * 1000:7.2f} ms  "
+        f"p99 {percentiles[98] * 1000:7.2f} ms"
+    )
+
+
+def run_wsgi(path_info, token, requests, threads):
+    # A threaded WSGI server: each request holds one of the threads until the
+    # view has finished, database waits included.
+    handler = WSGIHandler()
+    statuses = []
+
+    def request(_):
+        environ = {
+            'PATH_INFO': path_info,
+            'HTTP_HOST': BENCHMARK_HOST,
+            'HTTP_AUTHORIZATION': f'Bearer {token}',
+        }
+        setup_testing_defaults(environ)
+        started = time.perf_counter()
+        response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            b''.join(response)
+        finally:
+            response.close()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(request, range(requests)))
+    return latencies, time.perf_counter() - started, statuses
+
+
+async def run_asgi(path_info, token, requests, concurrency):
+    # One event loop with up to ``concurrency`` requests in flight.
+    handler = ASGIHandler()
+    statuses = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def request():
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path_info,
+            'raw_path': path_info.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', BENCHMARK_HOST.encode()), (b'authorization', f'Bearer {token}'.encode())],
+            'client': ('127.0.0.1', 0),
+            'server': (BENCHMARK_HOST, 80),
+        }
+        body_sent = False
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # The client never disconnects; Django cancels this wait itself.
+            await asyncio.Future()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        async with slots:
+            started = time.perf_counter()
+            await handler(scope, receive, send)
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(request() for _ in range(requests)))
+    return latencies, time.perf_counter() - started, statuses
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the read endpoints served by sync views on WSGI threads with the async views on an ASGI event "
+        "loop: requests per second and p50/p99 latency, in-process against the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', action='append', choices=sorted(async_read_views),
+                            help="URL name to measure; repeatable. Defaults to all async read views.")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads.")
+        parser.add_argument('--concurrency', type=int, default=64, help="ASGI requests in flight.")
+        parser.add_argument('--transactions', type=int, default=200, help="Rows seeded for the history endpoint.")
+
+    def handle(self, *args, **options):
+        sync_urls = _urlconf('benchmark_sync_urls', sync_urlpatterns)
+        async_urls = _urlconf('benchmark_async_urls', with_async_views(sync_urlpatterns))
+
+        user = User.objects.create_user(f'benchmark-{time.time_ns()}')
+        try:
+            Transaction.objects.bulk_create([
+                Transaction(wallet=user.wallet, transaction_type='deposit', amount=1)
+                for _ in range(options['transactions'])
+            ])
+            token = str(WalletRefreshToken.for_user(user).access_token)
+            for name in options['endpoint'] or sorted(async_read_views):
+                path_info = reverse(name, urlconf=sync_urls)
+                with override_settings(ROOT_URLCONF=sync_urls, ALLOWED_HOSTS=[BENCHMARK_HOST]):
+                    latencies, elapsed, statuses = run_wsgi(path_info, token, options['requests'], options['threads'])
+                self.write(name, f"wsgi {options['threads']} threads", latencies, elapsed, statuses)
+                with override_settings(ROOT_URLCONF=async_urls, ALLOWED_HOSTS=[BENCHMARK_HOST]):
+                    latencies, elapsed, statuses = asyncio.run(
+                        run_asgi(path_info, token, options['requests'], options['concurrency'])
+                    )
+                self.write(name, f"asgi {options['concurrency']} in flight", latencies, elapsed, statuses)
+        finally:
+            user.delete()
+
+    def write(self, name, mode, latencies, elapsed, statuses):
+        errors = sum(1 for status in statuses if not str(status).startswith('2'))
+        self.stdout.write(f"{name:<15} {mode:<20} {_report(latencies, elapsed)}  errors {errors}")
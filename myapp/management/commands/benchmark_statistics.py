@@ -0,0 +1,118 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from myapp.models import Message, Transaction, Wallet
+from myapp.stats import STATISTICS_WINDOWS, _window_start, live_statistics, rebuild_statistics, rollup_statistics
+
+SEED_BATCH_SIZE = 5000
+
+
+def legacy_statistics(windows=STATISTICS_WINDOWS):
+    # The original implementation: a count, a sum and a message count per
+    # window, each its own query over the table.
+    today = timezone.localdate()
+    result = {}
+    for name, days in windows.items():
+        start = _window_start(today, days)
+        transactions = Transaction.objects.filter(timestamp__gte=start)
+        result[f'transaction_count_{name}'] = transactions.count()
+        result[f'transaction_volume_{name}'] = transactions.aggregate(Sum('amount'))['amount__sum'] or 0
+        result[f'message_count_{name}'] = Message.objects.filter(timestamp__gte=start).count()
+    return result
+
+
+def _spread(model, ids, days):
+    # auto_now_add stamps every row with the current time; move contiguous id
+    # blocks back one day each so the rows cover the whole period.
+    block = max(1, len(ids) // days)
+    now = timezone.now()
+    for day, first in enumerate(range(0, len(ids), block)):
+        chunk = ids[first:first + block]
+        model.objects.filter(id__gte=chunk[0], id__lte=chunk[-1]).update(timestamp=now - timedelta(days=day % days))
+
+
+def seed(users, transactions, messages, days):
+    users = User.objects.bulk_create([User(username=f'benchmark-{time.time_ns()}-{index}') for index in range(users)])
+    wallets = Wallet.objects.bulk_create([Wallet(user=user) for user in users])
+
+    ids = []
+    for first in range(0, transactions, SEED_BATCH_SIZE):
+        rows = Transaction.objects.bulk_create([
+            Transaction(
+                wallet=random.choice(wallets),
+                transaction_type=random.choice(['deposit', 'transfer', 'receive']),
+                amount=random.randint(1, 100000) / 100,
+            )
+            for _ in range(min(SEED_BATCH_SIZE, transactions - first))
+        ])
+        ids.extend(row.pk for row in rows)
+    _spread(Transaction, ids, days)
+
+    ids = []
+    for first in range(0, messages, SEED_BATCH_SIZE):
+        rows = Message.objects.bulk_create([
+            Message(sender=random.choice(users), receiver=random.choice(users), text='benchmark')
+            for _ in range(min(SEED_BATCH_SIZE, messages - first))
+        ])
+        ids.extend(row.pk for row in rows)
+    _spread(Message, ids, days)
+    rebuild_statistics(days)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the statistics implementations on a seeded dataset: the original per-window queries, "
+        "the live conditional aggregates and the daily rollups. The seeded rows are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--transactions', type=int, default=100000)
+        parser.add_argument('--messages', type=int, default=50000)
+        parser.add_argument('--days', type=int, default=400, help="Period the seeded rows are spread over.")
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        implementations = [
+            ('legacy', legacy_statistics),
+            ('live', live_statistics),
+            ('rollup', rollup_statistics),
+        ]
+        with transaction.atomic():
+            started = time.perf_counter()
+            seed(options['users'], options['transactions'], options['messages'], options['days'])
+            self.stderr.write(f"Seeded {options['transactions']} transactions and {options['messages']} messages "
+                              f"in {time.perf_counter() - started:.1f}s.")
+
+            results = {}
+            for name, function in implementations:
+                with CaptureQueriesContext(connection) as queries:
+                    results[name] = function()
+                timings = []
+                for _ in range(options['iterations']):
+                    started = time.perf_counter()
+                    function()
+                    timings.append((time.perf_counter() - started) * 1000)
+                p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+                self.stdout.write(
+                    f"{name:<8} {len(queries):>2} queries  median {statistics.median(timings):8.2f} ms  "
+                    f"p95 {p95:8.2f} ms"
+                )
+
+            # SQLite sums decimals as floats, so results are compared in cents.
+            results = {
+                name: {key: Decimal(value).quantize(Decimal('0.01')) for key, value in result.items()}
+                for name, result in results.items()
+            }
+            for name in ('live', 'rollup'):
+                if results[name] != results['legacy']:
+                    self.stderr.write(f"{name} results differ from legacy: {results[name]} != {results['legacy']}")
+            transaction.set_rollback(True)
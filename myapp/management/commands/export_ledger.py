@@ -0,0 +1,49 @@
+import sys
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from myapp.exports import EXPORT_FORMATS, export_rows
+from myapp.filters import TransactionFilter
+from myapp.models import Transaction
+
+
+class Command(BaseCommand):
+    help = "Export transactions as CSV, gzip-compressed CSV, NDJSON or Parquet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help="Output file. Defaults to stdout.")
+        parser.add_argument('--username', help="Only export this user's wallet.")
+        parser.add_argument('--start-date', help="ISO date/time, inclusive.")
+        parser.add_argument('--end-date', help="ISO date/time, inclusive.")
+
+    def handle(self, *args, **options):
+        queryset = Transaction.objects.all()
+        if options['username']:
+            try:
+                user = User.objects.select_related('wallet').get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['username']!r} does not exist.")
+            queryset = queryset.filter(wallet=user.wallet)
+
+        filterset = TransactionFilter(
+            {'start_date': options['start_date'], 'end_date': options['end_date']},
+            queryset=queryset,
+        )
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        stream = EXPORT_FORMATS[options['format']][0]
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        written = 0
+        try:
+            for chunk in stream(export_rows(filterset.qs)):
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+
+        if options['output']:
+            self.stderr.write(f"Wrote {written} bytes to {options['output']}")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from myapp.models import Message
+from myapp.previews import generate_previews
+
+
+class Command(BaseCommand):
+    help = "Build thumbnails and metadata for attachments that have not been processed yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        pending = Message.objects.filter(mime_type='').exclude(file='').exclude(file__isnull=True) \
+            .order_by('id').values_list('id', flat=True)
+        processed = 0
+        for message_id in pending.iterator(chunk_size=options['chunk_size']):
+            processed += generate_previews(message_id)
+        self.stdout.write(f"Processed {processed} attachments.")
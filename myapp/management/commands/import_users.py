@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from myapp.onboarding import IMPORT_CHUNK_SIZE, IMPORT_FORMATS, chunked, hashing_pool, import_chunk, read_users
+
+
+class Command(BaseCommand):
+    help = "Bulk import users, with a wallet each, from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File with username, email and password fields, or - for stdin.")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, help="Password hashing processes. Defaults to the CPU count.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format']
+        if file_format is None:
+            extension = os.path.splitext(path)[1].lstrip('.').lower()
+            file_format = {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(extension)
+            if file_format is None:
+                raise CommandError("Cannot tell the file format, pass --format.")
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(str(e))
+
+        imported = skipped = 0
+        seen = set()
+        started = time.monotonic()
+        try:
+            with hashing_pool(options['workers']) as pool:
+                for rows in chunked(read_users(stream, file_format), options['chunk_size']):
+                    chunk_imported, chunk_skipped = import_chunk(rows, pool, options['workers'], seen)
+                    imported += chunk_imported
+                    skipped += chunk_skipped
+                    elapsed = time.monotonic() - started
+                    self.stderr.write(
+                        f"Imported {imported} users, skipped {skipped} ({imported / elapsed:.0f} users/s)"
+                    )
+        except ValueError as e:
+            raise CommandError(f"Invalid input: {e}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(f"Imported {imported} users and skipped {skipped} in {time.monotonic() - started:.1f}s.")
@@ -0,0 +1,86 @@
+import asyncio
+import resource
+import time
+import tracemalloc
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+from myapp.realtime import get_broker, user_topic
+from myapp.websocket import WEBSOCKET_PATH
+
+
+class Client:
+    # One WebSocket connection driven directly through the ASGI interface, so
+    # only the application's own cost per connection is measured.
+    def __init__(self, application, token):
+        self.incoming = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        scope = {
+            'type': 'websocket',
+            'path': WEBSOCKET_PATH,
+            'query_string': f'token={token}'.encode(),
+            'headers': [],
+        }
+        self.incoming.put_nowait({'type': 'websocket.connect'})
+        self.task = asyncio.ensure_future(application(scope, self.incoming.get, self.sent.put))
+
+    async def accepted(self):
+        message = await self.sent.get()
+        return message['type'] == 'websocket.accept'
+
+    async def close(self):
+        self.incoming.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        await self.task
+
+
+class Command(BaseCommand):
+    help = "Open many WebSocket connections against the ASGI application and report how many were held and the memory used."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--batch', type=int, default=200, help="Connections opened concurrently.")
+        parser.add_argument('--hold', type=float, default=0, help="Seconds to keep the connections open.")
+
+    def handle(self, *args, **options):
+        if options['connections'] < 1 or options['batch'] < 1:
+            raise CommandError("--connections and --batch must be at least 1.")
+        from myproject.asgi import application
+
+        user = User.objects.create_user(f'loadtest-{time.time_ns()}')
+        try:
+            token = str(AccessToken.for_user(user))
+            asyncio.run(self.run(application, token, user.pk, options))
+        finally:
+            user.delete()
+
+    async def run(self, application, token, user_id, options):
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        clients = []
+        held = 0
+        for first in range(0, options['connections'], options['batch']):
+            batch = [Client(application, token) for _ in range(min(options['batch'], options['connections'] - first))]
+            held += sum(await asyncio.gather(*(client.accepted() for client in batch)))
+            clients.extend(batch)
+        opened = time.perf_counter() - started
+        await asyncio.sleep(options['hold'])
+
+        heap = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(
+            f"Held {held} of {options['connections']} connections, opened in {opened:.2f}s "
+            f"({held / opened:.0f}/s), subscribers {get_broker().subscriber_count()}"
+        )
+        self.stdout.write(
+            f"Python heap {heap / 1024 / 1024:.1f} MiB ({heap / max(held, 1) / 1024:.1f} KiB per connection), "
+            f"peak RSS {rss:.1f} MiB"
+        )
+
+        started = time.perf_counter()
+        get_broker().publish(user_topic(user_id), {'type': 'loadtest'})
+        await asyncio.gather(*(client.sent.get() for client in clients))
+        self.stdout.write(f"Broadcast reached {len(clients)} connections in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        await asyncio.gather(*(client.close() for client in clients))
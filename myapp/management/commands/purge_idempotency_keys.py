@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from myapp.idempotency import IDEMPOTENCY_KEY_TTL, PURGE_BATCH_SIZE, purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = f"Delete idempotency keys older than {IDEMPOTENCY_KEY_TTL}, with their stored responses. Run it periodically."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys(options['batch_size'])
+        self.stdout.write(f"Deleted {deleted} expired idempotency keys.")
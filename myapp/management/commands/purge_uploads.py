@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from myapp.uploads import PURGE_BATCH_SIZE, UPLOAD_EXPIRY, purge_expired_uploads
+
+
+class Command(BaseCommand):
+    help = f"Delete uploads started more than {UPLOAD_EXPIRY} ago, with their part files. Run it periodically."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_uploads(options['batch_size'])
+        self.stdout.write(f"Deleted {deleted} expired uploads.")
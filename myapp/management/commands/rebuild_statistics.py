@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from myapp.stats import STATISTICS_WINDOWS, rebuild_statistics
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily statistics rollups from the transaction and message tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=max(STATISTICS_WINDOWS.values()),
+            help="Number of days, counting back from today, to rebuild.",
+        )
+
+    def handle(self, *args, **options):
+        rows = rebuild_statistics(options['days'])
+        self.stdout.write(f"Rebuilt {rows} daily rollup rows for the last {options['days']} days.")
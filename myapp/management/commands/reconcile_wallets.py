@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from myapp.ledger import (
+    LEDGER_CHECKPOINT_INTERVAL, RECONCILE_CHUNK_SIZE, ledger_imbalance, reconcile_chunk, wallet_chunks,
+)
+
+
+class Command(BaseCommand):
+    help = "Compare every wallet balance with its ledger and report drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, default=4, help="Chunks checked in parallel.")
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Sum each wallet's whole ledger instead of starting from its latest checkpoint.",
+        )
+        parser.add_argument(
+            '--checkpoint-interval', type=int, default=LEDGER_CHECKPOINT_INTERVAL,
+            help="Checkpoint wallets with at least this many entries since their last checkpoint.",
+        )
+
+    def handle(self, *args, **options):
+        def check(bounds):
+            try:
+                return reconcile_chunk(*bounds, full=options['full'], checkpoint_interval=options['checkpoint_interval'])
+            finally:
+                # Each worker thread has its own connection.
+                connections.close_all()
+
+        drift = []
+        checkpoints = chunks = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for chunk_drift, chunk_checkpoints in executor.map(check, wallet_chunks(options['chunk_size'])):
+                drift.extend(chunk_drift)
+                checkpoints += chunk_checkpoints
+                chunks += 1
+
+        for row in drift:
+            self.stdout.write(
+                f"{row['wallet_address']}: balance {row['balance']}, ledger {row['ledger_balance']}, "
+                f"difference {row['difference']}"
+            )
+        imbalance = ledger_imbalance()
+        if imbalance:
+            # Entries of deleted wallets are removed with them, so this is only
+            # a hint unless wallets are never deleted.
+            self.stderr.write(f"Ledger entries do not sum to zero: {imbalance}")
+        self.stdout.write(f"Checked {chunks} chunks, {len(drift)} wallets drifted, {checkpoints} checkpoints written.")
+        if drift:
+            raise CommandError(f"{len(drift)} wallets do not match their ledger.")
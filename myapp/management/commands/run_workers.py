@@ -0,0 +1,64 @@
+import multiprocessing
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from myapp.jobs import JOB_POLL_INTERVAL, worker_main
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs from the job table until stopped. Deployments need at least one running: "
+        "statistics rollups and attachment previews are only updated by these workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Worker processes.")
+        parser.add_argument('--poll-interval', type=float, default=JOB_POLL_INTERVAL,
+                            help="Seconds an idle worker waits before looking for jobs again.")
+        parser.add_argument('--burst', action='store_true', help="Exit once no jobs are due.")
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if concurrency < 1:
+            raise CommandError("--concurrency must be at least 1.")
+        worker_args = (options['poll_interval'], options['burst'])
+        if concurrency == 1:
+            processed = worker_main(*worker_args)
+            self.stdout.write(f"Processed {processed} jobs.")
+            return
+
+        # Workers are forked with Django already set up, but without this
+        # process's database connections.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stopping = False
+
+        def start(index):
+            process = context.Process(target=worker_main, args=worker_args, name=f'job-worker-{index}')
+            process.start()
+            return process
+
+        def stop(*args):
+            nonlocal stopping
+            stopping = True
+            for process in workers.values():
+                process.terminate()
+
+        workers = {index: start(index) for index in range(concurrency)}
+        signal.signal(signal.SIGTERM, stop)
+        self.stderr.write(f"Started {concurrency} workers.")
+        while workers:
+            try:
+                for index, process in list(workers.items()):
+                    process.join(options['poll_interval'])
+                    if process.is_alive():
+                        continue
+                    if process.exitcode == 0 or stopping:
+                        del workers[index]
+                    else:
+                        self.stderr.write(f"{process.name} exited with {process.exitcode}, restarting it.")
+                        workers[index] = start(index)
+            except KeyboardInterrupt:
+                # Ctrl-C reached the workers too; wait for their current jobs.
+                stopping = True
+        self.stdout.write("Workers stopped.")
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+BACKFILL_CHUNK_SIZE = 2000
+
+
+def backfill_ledger(apps, schema_editor):
+    # Historical models cannot import myapp.ledger, so the posting rules of
+    # ledger_entries() are repeated here.
+    Transaction = apps.get_model('myapp', 'Transaction')
+    LedgerEntry = apps.get_model('myapp', 'LedgerEntry')
+
+    batch = []
+    rows = Transaction.objects.order_by('id').values_list('id', 'wallet_id', 'transaction_type', 'amount', 'timestamp')
+    for transaction_id, wallet_id, transaction_type, amount, timestamp in rows.iterator(chunk_size=BACKFILL_CHUNK_SIZE):
+        if transaction_type == 'deposit':
+            legs = [(wallet_id, amount), (None, -amount)]
+        elif transaction_type == 'transfer':
+            legs = [(wallet_id, -amount)]
+        else:
+            legs = [(wallet_id, amount)]
+        batch.extend(
+            LedgerEntry(
+                wallet_id=leg_wallet_id,
+                transaction_id=transaction_id,
+                entry_type=transaction_type,
+                amount=leg_amount,
+                timestamp=timestamp,
+            )
+            for leg_wallet_id, leg_amount in legs
+        )
+        if len(batch) >= BACKFILL_CHUNK_SIZE:
+            LedgerEntry.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        LedgerEntry.objects.bulk_create(batch)
+
+
+def clear_ledger(apps, schema_editor):
+    apps.get_model('myapp', 'BalanceCheckpoint').objects.all().delete()
+    apps.get_model('myapp', 'LedgerEntry').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_ledger, clear_ledger),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0015_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='myapp.message'),
+        ),
+    ]
@@ -2,6 +2,9 @@ import uuid
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
 
 class Wallet(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="wallet")
@@ -15,6 +18,19 @@ class Wallet(models.Model):
     def __str__(self):
         return f"Wallet of {self.user.username} - Balance: {self.balance}"
 
+class ClaimsUser(User):
+    # request.user for stateless JWT requests: built from token claims with
+    # everything but the id deferred. The first deferred attribute that is
+    # read loads the rest of the row in one query, not one per attribute.
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred and set(fields) <= deferred:
+            fields = deferred
+        super().refresh_from_db(using, fields, from_queryset)
+
 class Transaction(models.Model):
     TRANSACTION_TYPES = [
         ('deposit', 'Deposit'),  
@@ -29,17 +45,210 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', '-timestamp'], name='tx_wallet_timestamp_idx'),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type} - {self.amount}"
     
 
+class StoredFile(models.Model):
+    # File content stored once under its SHA-256 digest and shared by every
+    # message that sends the same bytes.
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='files/')
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256} ({self.size} bytes)"
+
+
 class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
     text = models.TextField(blank=True, null=True)  
     file = models.FileField(upload_to='messages/', null=True, blank=True) 
+    stored_file = models.ForeignKey(StoredFile, on_delete=models.PROTECT, null=True, blank=True, related_name='messages')
+    file_name = models.CharField(max_length=255, blank=True, default='')
+    # Filled in by the preview pipeline once the attachment has been processed.
+    mime_type = models.CharField(max_length=100, blank=True, default='')
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail = models.FileField(upload_to='previews/', null=True, blank=True)
+    preview = models.FileField(upload_to='previews/', null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['sender', 'receiver', 'timestamp'], name='msg_pair_timestamp_idx'),
+            models.Index(
+                fields=['receiver', 'sender'],
+                condition=models.Q(is_read=False),
+                name='msg_unread_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender} to {self.receiver}"
+
+
+class Conversation(models.Model):
+    # Participants are stored in id order so each pair has exactly one row.
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_preview = models.CharField(max_length=255, blank=True, default='')
+    last_timestamp = models.DateTimeField()
+    unread_low = models.PositiveIntegerField(default=0)
+    unread_high = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='unique_conversation'),
+        ]
+        indexes = [
+            models.Index(fields=['user_low', '-last_timestamp'], name='conv_low_timestamp_idx'),
+            models.Index(fields=['user_high', '-last_timestamp'], name='conv_high_timestamp_idx'),
+        ]
+
+    def __str__(self):
+        return f"Conversation between {self.user_low_id} and {self.user_high_id}"
+
+class DailyStatistic(models.Model):
+    KINDS = Transaction.TRANSACTION_TYPES + [
+        ('message', 'Message'),
+    ]
+
+    day = models.DateField()
+    kind = models.CharField(max_length=10, choices=KINDS)
+    count = models.PositiveBigIntegerField(default=0)
+    volume = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'kind'], name='unique_daily_statistic'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.kind}: {self.count} / {self.volume}"
+
+class LedgerEntry(models.Model):
+    # Append-only double-entry ledger. Every posting is balanced: deposits are
+    # matched by an entry on the external account (wallet is null), transfers
+    # by the entries on the sender and receiver wallets.
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, null=True, blank=True, related_name="ledger_entries")
+    transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name="ledger_entries")
+    entry_type = models.CharField(max_length=10, choices=Transaction.TRANSACTION_TYPES)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', 'id'], name='ledger_wallet_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValidationError("Ledger entries cannot be modified.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError("Ledger entries cannot be deleted.")
+
+    def __str__(self):
+        return f"{self.entry_type} {self.amount} on wallet {self.wallet_id}"
+
+
+class BalanceCheckpoint(models.Model):
+    # The wallet balance after ``entry``, the last ledger entry it covers.
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name="balance_checkpoints")
+    entry = models.ForeignKey(LedgerEntry, on_delete=models.CASCADE, related_name='+')
+    balance = models.DecimalField(max_digits=15, decimal_places=2)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'entry'], name='unique_balance_checkpoint'),
+        ]
+        indexes = [
+            models.Index(fields=['wallet', '-timestamp'], name='checkpoint_wallet_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"Wallet {self.wallet_id} balance {self.balance} at {self.timestamp}"
+
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=JSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idem_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} of user {self.user_id}"
+
+
+class Upload(models.Model):
+    # A chunked upload in progress. Parts are appended to a file under
+    # UPLOAD_PARTS_DIR until all ``size`` bytes have been received.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    file_name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    stored_file = models.ForeignKey(StoredFile, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # The message sent on completion; a repeated complete call returns it
+    # instead of sending another one.
+    message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='upload_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.pk}: {self.received}/{self.size} bytes"
+
+
+class Job(models.Model):
+    # A unit of background work. Queued rows are claimed with SELECT ... FOR
+    # UPDATE SKIP LOCKED and deleted once their handler succeeds; rows that
+    # ran out of attempts stay behind as failed.
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_at', 'id'], condition=models.Q(status='queued'), name='job_queued_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status}, attempt {self.attempts})"
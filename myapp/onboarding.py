@@ -0,0 +1,89 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from .models import Wallet
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+
+def read_users(stream, file_format):
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def _setup_worker():
+    # Hashers are configured through settings, so each worker process needs
+    # its own django.setup().
+    django.setup()
+
+
+def hashing_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_setup_worker)
+
+
+def hash_passwords(pool, passwords, workers):
+    # make_password(None) gives an unusable password, like set_unusable_password().
+    chunksize = max(1, len(passwords) // ((workers or os.cpu_count()) * 4))
+    return list(pool.map(make_password, passwords, chunksize=chunksize))
+
+
+def _text(row, field):
+    value = row.get(field)
+    return value if isinstance(value, str) else ''
+
+
+def import_chunk(rows, pool, workers, seen):
+    # Users and wallets are inserted with bulk_create(), which sends no
+    # post_save signals, so create_wallet and the cache invalidation never
+    # run per user. Rows that are not objects, lack a username or name an
+    # existing user are skipped.
+    candidates = []
+    skipped = 0
+    for row in rows:
+        username = _text(row, 'username').strip() if isinstance(row, dict) else ''
+        if not username or username in seen:
+            skipped += 1
+            continue
+        seen.add(username)
+        candidates.append((username, _text(row, 'email').strip(), _text(row, 'password') or None))
+
+    existing = set(
+        User.objects.filter(username__in=[username for username, _, _ in candidates])
+        .values_list('username', flat=True)
+    )
+    candidates = [candidate for candidate in candidates if candidate[0] not in existing]
+    skipped += len(existing)
+    if not candidates:
+        return 0, skipped
+
+    hashes = hash_passwords(pool, [password for _, _, password in candidates], workers)
+    users = [
+        User(username=username, email=email, password=password_hash)
+        for (username, email, _), password_hash in zip(candidates, hashes)
+    ]
+    with transaction.atomic():
+        # Another process may have taken some of these usernames since the
+        # check above; those rows are left alone instead of failing the chunk.
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        # ignore_conflicts leaves the primary keys unset, so the users this
+        # chunk inserted are found again: the ones still without a wallet.
+        created = list(User.objects.filter(username__in=[user.username for user in users], wallet__isnull=True))
+        Wallet.objects.bulk_create([Wallet(user=user) for user in created])
+    return len(created), skipped + len(users) - len(created)
@@ -0,0 +1,117 @@
+import io
+import mimetypes
+import shutil
+import subprocess
+from django.core.files.base import ContentFile
+from .jobs import enqueue
+from .models import Message
+
+PREVIEW_SIZES = {
+    'thumbnail': 256,
+    'preview': 1024,
+}
+PREVIEW_FORMAT = 'WEBP'
+PREVIEW_QUALITY = 80
+VIDEO_FRAME_TIMEOUT = 30
+
+PREVIEW_FIELDS = ['mime_type', 'file_size', 'width', 'height', *PREVIEW_SIZES]
+
+
+def _preview_name(message, label):
+    # Named after the content when it is deduplicated, so every message that
+    # shares a StoredFile also shares its previews.
+    if message.stored_file_id is not None:
+        sha256 = message.stored_file.sha256
+        return f'previews/{sha256[:2]}/{sha256}-{label}.webp'
+    return f'previews/messages/{message.pk}-{label}.webp'
+
+
+def _mime_type(message):
+    return mimetypes.guess_type(message.file_name or message.file.name)[0] or 'application/octet-stream'
+
+
+def _video_frame(message):
+    # Video posters need ffmpeg; without it videos only get their metadata.
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return None
+    try:
+        path = message.file.path
+    except NotImplementedError:
+        return None
+    result = subprocess.run(
+        [ffmpeg, '-v', 'error', '-i', path, '-frames:v', '1', '-f', 'image2pipe', '-vcodec', 'png', '-'],
+        capture_output=True, timeout=VIDEO_FRAME_TIMEOUT,
+    )
+    return io.BytesIO(result.stdout) if result.returncode == 0 and result.stdout else None
+
+
+def _open_image(message, mime_type):
+    from PIL import Image, ImageOps
+
+    if mime_type.startswith('image/'):
+        source = message.file.storage.open(message.file.name, 'rb')
+    elif mime_type.startswith('video/'):
+        source = _video_frame(message)
+        if source is None:
+            return None
+    else:
+        return None
+    try:
+        with source:
+            image = Image.open(source)
+            image.load()
+            # Dimensions and previews follow the orientation the user sees.
+            return ImageOps.exif_transpose(image)
+    except (Image.DecompressionBombError, OSError):
+        return None
+
+
+def _render(image, max_edge):
+    preview = image.copy()
+    preview.thumbnail((max_edge, max_edge))
+    if preview.mode not in ('RGB', 'RGBA'):
+        preview = preview.convert('RGBA' if 'A' in preview.getbands() else 'RGB')
+    buffer = io.BytesIO()
+    preview.save(buffer, PREVIEW_FORMAT, quality=PREVIEW_QUALITY)
+    return buffer.getvalue()
+
+
+def generate_previews(message_id):
+    # Safe to run any number of times: processed messages are skipped, preview
+    # files that already exist are reused, and only an unprocessed row is
+    # updated.
+    message = Message.objects.select_related('stored_file').filter(pk=message_id).first()
+    if message is None or not message.file or message.mime_type:
+        return False
+
+    if message.stored_file_id is not None:
+        processed = Message.objects.filter(stored_file_id=message.stored_file_id).exclude(mime_type='') \
+            .values(*PREVIEW_FIELDS).first()
+        if processed is not None:
+            return bool(Message.objects.filter(pk=message.pk, mime_type='').update(**processed))
+
+    mime_type = _mime_type(message)
+    fields = {
+        'mime_type': mime_type,
+        'file_size': message.stored_file.size if message.stored_file_id is not None else message.file.size,
+    }
+    image = _open_image(message, mime_type)
+    if image is not None:
+        fields['width'], fields['height'] = image.size
+        storage = message.file.storage
+        for label, max_edge in PREVIEW_SIZES.items():
+            name = _preview_name(message, label)
+            if not storage.exists(name):
+                saved = storage.save(name, ContentFile(_render(image, max_edge)))
+                if saved != name:
+                    # A concurrent job wrote the same preview first.
+                    storage.delete(saved)
+            fields[label] = name
+    return bool(Message.objects.filter(pk=message.pk, mime_type='').update(**fields))
+
+
+def schedule_previews(message):
+    # Previews are built by a background job, so sending never waits on image
+    # decoding.
+    enqueue(generate_previews, message_id=message.pk)
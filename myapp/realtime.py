@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def user_topic(user_id):
+    return f"user:{user_id}"
+
+
+class InProcessBroker:
+    # Fans events out to subscribers living in this process. Publishers may
+    # run on any thread; delivery is handed to each subscriber's event loop.
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[topic].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, topic, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(topic, set())
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(topic, None)
+
+    def publish(self, topic, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # The subscriber's loop has already shut down.
+                pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    @staticmethod
+    def _deliver(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client that stopped reading loses events rather than memory.
+            pass
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(getattr(settings, 'REALTIME_BROKER', 'myapp.realtime.InProcessBroker'))()
+
+
+def publish(user_ids, event):
+    # Events are only sent once the write that produced them is committed.
+    def send():
+        broker = get_broker()
+        for user_id in set(user_ids):
+            broker.publish(user_topic(user_id), event)
+    transaction.on_commit(send)
+
+
+def publish_balances(*wallets):
+    for wallet in wallets:
+        publish([wallet.user_id], {
+            "type": "balance.changed",
+            "wallet_address": str(wallet.address),
+            "balance": str(wallet.balance),
+        })
+
+
+def transaction_event(transaction_id, transaction_type, amount, timestamp, wallet_address, sender_address, receiver_address):
+    return {
+        "type": "transaction",
+        "transaction": {
+            "id": transaction_id,
+            "transaction_type": transaction_type,
+            "amount": str(amount),
+            "timestamp": timestamp.isoformat(),
+            "wallet_address": str(wallet_address),
+            "sender_address": str(sender_address) if sender_address else None,
+            "receiver_address": str(receiver_address) if receiver_address else None,
+        },
+    }
+
+
+def publish_transactions(transactions):
+    for tx in transactions:
+        publish([tx.wallet.user_id], transaction_event(
+            tx.pk,
+            tx.transaction_type,
+            tx.amount,
+            tx.timestamp,
+            tx.wallet.address,
+            tx.sender.address if tx.sender_id else None,
+            tx.receiver.address if tx.receiver_id else None,
+        ))
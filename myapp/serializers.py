@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.urls import reverse
 from rest_framework import serializers
 from .models import Transaction,Message
 
@@ -61,10 +62,30 @@ class TransactionSerializer(serializers.ModelSerializer):
 class MessageSerializer(serializers.ModelSerializer):
     sender_wallet_address = serializers.CharField(source='sender.wallet.address', read_only=True)
     receiver_wallet_address = serializers.CharField(source='receiver.wallet.address', read_only=True)
+    thumbnail = serializers.SerializerMethodField()
+    preview = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ['id', 'sender_wallet_address', 'receiver_wallet_address', 'text', 'file', 'timestamp', 'is_read']
+        fields = [
+            'id', 'sender_wallet_address', 'receiver_wallet_address', 'text', 'file', 'file_name',
+            'mime_type', 'file_size', 'width', 'height', 'thumbnail', 'preview', 'timestamp', 'is_read',
+        ]
+
+    def _variant_url(self, message, variant):
+        # Previews live in private storage, so they are linked through the
+        # download endpoint, which checks that the caller is a participant.
+        if not getattr(message, variant):
+            return None
+        url = reverse('message_file', args=[message.pk]) + f'?variant={variant}'
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_thumbnail(self, message):
+        return self._variant_url(message, 'thumbnail')
+
+    def get_preview(self, message):
+        return self._variant_url(message, 'preview')
 class ChatListSerializer(serializers.Serializer):
     wallet_address = serializers.CharField()
     last_message = serializers.CharField()
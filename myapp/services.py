@@ -0,0 +1,196 @@
+import uuid
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import Q
+from .caching import invalidate_wallets
+from .ledger import post_transactions
+from .models import Wallet, Transaction
+from .realtime import publish_balances, publish_transactions
+from .stats import schedule_transactions
+
+MAX_BATCH_TRANSFER_SIZE = 1000
+AMOUNT_PRECISION = Decimal('0.01')
+MAX_AMOUNT = Decimal('1e13')
+
+
+class TransferError(Exception):
+    status_code = 400
+
+
+class InvalidAmount(TransferError):
+    pass
+
+
+class InsufficientBalance(TransferError):
+    pass
+
+
+class WalletNotFound(TransferError):
+    status_code = 404
+
+
+class BatchTransferError(TransferError):
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(str(value))
+        if not amount.is_finite():
+            raise InvalidOperation
+        quantized = amount.quantize(AMOUNT_PRECISION)
+    except (InvalidOperation, TypeError, ValueError):
+        raise InvalidAmount("Invalid amount.")
+    # Amounts must fit Wallet.balance / Transaction.amount (15 digits, 2 places).
+    if quantized != amount or not 0 < quantized < MAX_AMOUNT:
+        raise InvalidAmount("Invalid amount.")
+    return quantized
+
+
+def parse_address(value):
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        raise WalletNotFound("Receiver wallet not found.")
+
+
+def _lock_wallets(sender_user, addresses):
+    # Resolve and lock the sender and every receiver in one query. Locking in
+    # primary key order means two opposite transfers can never deadlock.
+    wallets = list(
+        Wallet.objects.select_for_update()
+        .filter(Q(user=sender_user) | Q(address__in=addresses))
+        .order_by('id')
+    )
+    sender_wallet = next((w for w in wallets if w.user_id == sender_user.pk), None)
+    if sender_wallet is None:
+        raise WalletNotFound("Wallet not found.")
+    receivers = {w.address: w for w in wallets if w is not sender_wallet}
+    return sender_wallet, receivers
+
+
+def _transfer_rows(sender_wallet, receiver_wallet, amount):
+    return [
+        Transaction(
+            wallet=sender_wallet,
+            sender=sender_wallet,
+            receiver=receiver_wallet,
+            transaction_type='transfer',
+            amount=amount,
+        ),
+        Transaction(
+            wallet=receiver_wallet,
+            sender=sender_wallet,
+            receiver=receiver_wallet,
+            transaction_type='receive',
+            amount=amount,
+        ),
+    ]
+
+
+def deposit_funds(user, amount):
+    amount = parse_amount(amount)
+
+    with transaction.atomic():
+        try:
+            wallet = Wallet.objects.select_for_update().get(user=user)
+        except Wallet.DoesNotExist:
+            raise WalletNotFound("Wallet not found.")
+        wallet.balance += amount
+        wallet.save(update_fields=['balance'])
+        invalidate_wallets(wallet)
+        row = Transaction.objects.create(wallet=wallet, transaction_type='deposit', amount=amount)
+        post_transactions([row])
+        publish_balances(wallet)
+        publish_transactions([row])
+
+    return wallet
+
+
+def transfer_funds(sender_user, receiver_address, amount):
+    amount = parse_amount(amount)
+    receiver_address = parse_address(receiver_address)
+
+    with transaction.atomic():
+        sender_wallet, receivers = _lock_wallets(sender_user, [receiver_address])
+
+        if sender_wallet.address == receiver_address:
+            raise TransferError("Cannot transfer to your own wallet.")
+        receiver_wallet = receivers.get(receiver_address)
+        if receiver_wallet is None:
+            raise WalletNotFound("Receiver wallet not found.")
+        if sender_wallet.balance < amount:
+            raise InsufficientBalance("Insufficient balance.")
+
+        sender_wallet.balance -= amount
+        receiver_wallet.balance += amount
+        Wallet.objects.bulk_update([sender_wallet, receiver_wallet], ['balance'])
+        invalidate_wallets(sender_wallet, receiver_wallet)
+        rows = Transaction.objects.bulk_create(_transfer_rows(sender_wallet, receiver_wallet, amount))
+        post_transactions(rows)
+        # bulk_create() skips post_save, so the rollups are fed explicitly.
+        schedule_transactions(rows)
+        publish_balances(sender_wallet, receiver_wallet)
+        publish_transactions(rows)
+
+    return sender_wallet, receiver_wallet, amount
+
+
+def batch_transfer(sender_user, items):
+    if not isinstance(items, list) or not items:
+        raise TransferError("Transfers must be a non-empty list.")
+    if len(items) > MAX_BATCH_TRANSFER_SIZE:
+        raise TransferError(f"A batch may contain at most {MAX_BATCH_TRANSFER_SIZE} transfers.")
+
+    results = []
+    parsed = []
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        result = {
+            "index": index,
+            "receiver_address": item.get('receiver_address'),
+            "amount": item.get('amount'),
+            "status": "ok",
+        }
+        results.append(result)
+        try:
+            if not item.get('receiver_address') or not item.get('amount'):
+                raise TransferError("Receiver address and amount are required.")
+            parsed.append((result, parse_address(item['receiver_address']), parse_amount(item['amount'])))
+        except TransferError as e:
+            result.update(status="error", error=str(e))
+
+    with transaction.atomic():
+        sender_wallet, receivers = _lock_wallets(sender_user, {address for _, address, _ in parsed})
+
+        for result, address, _ in parsed:
+            if address == sender_wallet.address:
+                result.update(status="error", error="Cannot transfer to your own wallet.")
+            elif address not in receivers:
+                result.update(status="error", error="Receiver wallet not found.")
+
+        if any(result["status"] == "error" for result in results):
+            raise BatchTransferError("Batch rejected, no transfers were made.", results)
+
+        total = sum((amount for _, _, amount in parsed), Decimal('0'))
+        if sender_wallet.balance < total:
+            raise BatchTransferError("Insufficient balance.", results)
+
+        rows = []
+        sender_wallet.balance -= total
+        for _, address, amount in parsed:
+            receiver_wallet = receivers[address]
+            receiver_wallet.balance += amount
+            rows.extend(_transfer_rows(sender_wallet, receiver_wallet, amount))
+
+        Wallet.objects.bulk_update([sender_wallet, *receivers.values()], ['balance'])
+        invalidate_wallets(sender_wallet, *receivers.values())
+        Transaction.objects.bulk_create(rows)
+        post_transactions(rows)
+        schedule_transactions(rows)
+        publish_balances(sender_wallet, *receivers.values())
+        publish_transactions(rows)
+
+    return sender_wallet, total, results
@@ -1,11 +1,42 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Wallet
+from .models import ClaimsUser, Wallet, Transaction, Message
+from .caching import invalidate_user
+from .stats import schedule_transactions, schedule_messages
 
 
+# Saves through request.user come from the ClaimsUser proxy, and Django sends
+# post_save with the proxy as sender, so the User receivers listen for both.
 @receiver(post_save, sender=User)
+@receiver(post_save, sender=ClaimsUser)
 def create_wallet(sender, instance, created, **kwargs):
     if created:
         Wallet.objects.create(user=instance)
+        invalidate_user(instance.pk)
 
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=ClaimsUser)
+def invalidate_cached_username(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    address = Wallet.objects.filter(user=instance).values_list('address', flat=True).first()
+    invalidate_user(instance.pk, address)
+
+
+@receiver(post_delete, sender=Wallet)
+def invalidate_deleted_wallet(sender, instance, **kwargs):
+    invalidate_user(instance.user_id, instance.address)
+
+
+@receiver(post_save, sender=Transaction)
+def record_transaction_statistics(sender, instance, created, **kwargs):
+    if created:
+        schedule_transactions([instance])
+
+
+@receiver(post_save, sender=Message)
+def record_message_statistics(sender, instance, created, **kwargs):
+    if created:
+        schedule_messages([instance])
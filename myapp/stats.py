@@ -0,0 +1,207 @@
+import re
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .jobs import enqueue, job_name
+from .models import DailyStatistic, Job, Message, Transaction
+
+STATISTICS_WINDOWS = {
+    'week': 7,
+    'month': 30,
+    'year': 365,
+}
+
+MAX_STATISTICS_WINDOW = 3650
+
+WINDOW_PATTERN = re.compile(r'^(\d+)d$')
+
+
+def _increment(day, kind, count, volume):
+    updated = DailyStatistic.objects.filter(day=day, kind=kind).update(
+        count=F('count') + count,
+        volume=F('volume') + volume,
+    )
+    if not updated:
+        _, created = DailyStatistic.objects.get_or_create(
+            day=day, kind=kind, defaults={'count': count, 'volume': volume},
+        )
+        if not created:
+            _increment(day, kind, count, volume)
+
+
+def record_transactions(transactions):
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    for tx in transactions:
+        total = totals[(timezone.localdate(tx.timestamp), tx.transaction_type)]
+        total[0] += 1
+        total[1] += tx.amount
+    for (day, kind), (count, volume) in totals.items():
+        _increment(day, kind, count, volume)
+
+
+def record_messages(messages):
+    totals = defaultdict(int)
+    for message in messages:
+        totals[timezone.localdate(message.timestamp)] += 1
+    for day, count in totals.items():
+        _increment(day, 'message', count, 0)
+
+
+def record_transaction_ids(ids):
+    record_transactions(Transaction.objects.filter(pk__in=ids).only('timestamp', 'transaction_type', 'amount'))
+
+
+def record_message_ids(ids):
+    record_messages(Message.objects.filter(pk__in=ids).only('timestamp'))
+
+
+def schedule_transactions(transactions):
+    # Rollups are bumped by a background job, so the hot per-day row is never
+    # locked by a request, let alone while wallet rows are held.
+    enqueue(record_transaction_ids, ids=[tx.pk for tx in transactions])
+
+
+def schedule_messages(messages):
+    enqueue(record_message_ids, ids=[message.pk for message in messages])
+
+
+STATISTICS_JOBS = [job_name(record_transaction_ids), job_name(record_message_ids)]
+
+
+def pending_statistics():
+    # Rollups only move when a job worker (manage.py run_workers) runs the
+    # increment jobs, so a growing backlog means they are falling behind.
+    # Failed increments stay missing until rebuild_statistics runs.
+    return Job.objects.filter(name__in=STATISTICS_JOBS).aggregate(
+        pending_updates=Count('id', filter=Q(status='queued')),
+        pending_since=Min('created_at', filter=Q(status='queued')),
+        failed_updates=Count('id', filter=Q(status='failed')),
+    )
+
+
+def _daily_totals(transactions, messages):
+    # (day, kind) -> [count, volume], bucketed by local day like the jobs do.
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    transactions = transactions.annotate(day=TruncDate('timestamp')) \
+        .values('day', 'transaction_type') \
+        .annotate(count=Count('id'), volume=Sum('amount'))
+    for row in transactions:
+        totals[(row['day'], row['transaction_type'])] = [row['count'], row['volume'] or Decimal('0')]
+    messages = messages.annotate(day=TruncDate('timestamp')).values('day').annotate(count=Count('id'))
+    for row in messages:
+        totals[(row['day'], 'message')] = [row['count'], Decimal('0')]
+    return totals
+
+
+def _pending_ids():
+    pending = {name: [] for name in STATISTICS_JOBS}
+    for name, payload in Job.objects.filter(status='queued', name__in=STATISTICS_JOBS).values_list('name', 'payload'):
+        pending[name].extend(payload['ids'])
+    return pending.values()
+
+
+def _lock_rollups(repeatable_read):
+    # Increment jobs wait for the rebuild: the rollup table is locked, so a
+    # job blocks on its first write and one already writing is waited for.
+    # With a single snapshot the rows counted and the jobs still queued then
+    # agree. On SQLite the delete that follows takes the write lock instead.
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        if repeatable_read:
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        cursor.execute(f'LOCK TABLE {connection.ops.quote_name(DailyStatistic._meta.db_table)} IN EXCLUSIVE MODE')
+
+
+def rebuild_statistics(days):
+    # Recounts the rollups from the raw rows, except rows whose increment job
+    # is still queued: the job adds those when it runs, so nothing is counted
+    # twice. Call it outside a transaction so it gets its own snapshot.
+    since = timezone.localdate() - timedelta(days=days - 1)
+    start = timezone.make_aware(datetime.combine(since, time.min))
+    repeatable_read = not connection.in_atomic_block
+
+    with transaction.atomic():
+        _lock_rollups(repeatable_read)
+        DailyStatistic.objects.filter(day__gte=since).delete()
+
+        transactions = Transaction.objects.filter(timestamp__gte=start)
+        messages = Message.objects.filter(timestamp__gte=start)
+        totals = _daily_totals(transactions, messages)
+        pending_transactions, pending_messages = _pending_ids()
+        if pending_transactions or pending_messages:
+            pending = _daily_totals(
+                transactions.filter(pk__in=pending_transactions), messages.filter(pk__in=pending_messages),
+            )
+            for key, (count, volume) in pending.items():
+                totals[key][0] -= count
+                totals[key][1] -= volume
+
+        rows = [
+            DailyStatistic(day=day, kind=kind, count=count, volume=volume)
+            for (day, kind), (count, volume) in totals.items() if count
+        ]
+        DailyStatistic.objects.bulk_create(rows)
+    return len(rows)
+
+
+def parse_windows(value):
+    if not value:
+        return STATISTICS_WINDOWS
+    windows = {}
+    for label in value.split(','):
+        label = label.strip()
+        match = WINDOW_PATTERN.match(label)
+        if not match or not 0 < int(match[1]) <= MAX_STATISTICS_WINDOW:
+            raise ValueError(f"Invalid window {label!r}.")
+        windows[label] = int(match[1])
+    return windows
+
+
+def _window_start(today, days):
+    # Windows cover whole days, today included, like the rollup rows do.
+    return timezone.make_aware(datetime.combine(today - timedelta(days=days - 1), time.min))
+
+
+def live_statistics(windows=STATISTICS_WINDOWS, user=None):
+    today = timezone.localdate()
+    longest = _window_start(today, max(windows.values()))
+
+    transactions = Transaction.objects.filter(timestamp__gte=longest)
+    messages = Message.objects.filter(timestamp__gte=longest)
+    if user is not None:
+        transactions = transactions.filter(wallet__user=user)
+        messages = messages.filter(Q(sender=user) | Q(receiver=user))
+
+    transaction_aggregates = {}
+    message_aggregates = {}
+    for name, days in windows.items():
+        in_window = Q(timestamp__gte=_window_start(today, days))
+        transaction_aggregates[f'transaction_count_{name}'] = Count('id', filter=in_window)
+        transaction_aggregates[f'transaction_volume_{name}'] = Sum('amount', filter=in_window)
+        message_aggregates[f'message_count_{name}'] = Count('id', filter=in_window)
+
+    result = {
+        **transactions.aggregate(**transaction_aggregates),
+        **messages.aggregate(**message_aggregates),
+    }
+    return {key: value or 0 for key, value in result.items()}
+
+
+def rollup_statistics(windows=STATISTICS_WINDOWS):
+    today = timezone.localdate()
+    is_message = Q(kind='message')
+    aggregates = {}
+    for name, days in windows.items():
+        in_window = Q(day__gt=today - timedelta(days=days))
+        aggregates[f'transaction_count_{name}'] = Sum('count', filter=in_window & ~is_message)
+        aggregates[f'transaction_volume_{name}'] = Sum('volume', filter=in_window & ~is_message)
+        aggregates[f'message_count_{name}'] = Sum('count', filter=in_window & is_message)
+
+    longest = max(windows.values())
+    result = DailyStatistic.objects.filter(day__gt=today - timedelta(days=longest)).aggregate(**aggregates)
+    return {key: value or 0 for key, value in result.items()}
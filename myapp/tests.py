@@ -1,3 +1,1329 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.test import AsyncClient, AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from .analytics import wallet_analytics
+from .async_views import token_obtain_pair
+from .caching import get_user_by_address, get_wallet_snapshot
+from .conversations import backfill_conversations, mark_messages_read, record_message, send_message
+from .exports import EXPORT_COLUMNS, export_rows, stream_ndjson
+from .idempotency import IDEMPOTENCY_KEY_TTL
+from .ledger import balance_as_of, ledger_imbalance, reconcile_chunk
+from .management.commands.benchmark_statistics import legacy_statistics, seed
+from .management.commands.loadtest_websockets import Client
+from .jobs import enqueue, job_name, retry_delay, run_next
+from .models import (
+    BalanceCheckpoint, Conversation, IdempotencyKey, Job, LedgerEntry, Message, Transaction, Upload, Wallet,
+)
+from .onboarding import import_chunk
+from .pagination import KeysetPagination
+from .previews import generate_previews
+from .realtime import get_broker, user_topic
+from .serializers import MessageSerializer
+from .services import (
+    MAX_BATCH_TRANSFER_SIZE, BatchTransferError, InsufficientBalance, InvalidAmount, TransferError, WalletNotFound,
+    batch_transfer, deposit_funds, parse_amount, transfer_funds,
+)
+from .stats import live_statistics, pending_statistics, rebuild_statistics, rollup_statistics
+from .tokens import WALLET_ADDRESS_CLAIM, WalletRefreshToken
+from .uploads import UPLOAD_EXPIRY, UploadConflict, part_path, store_file, write_part
+from .urls import sync_urlpatterns, with_async_views
+from .websocket import websocket_application
 
-# Create your tests here.
+
+def make_user(username, balance=None):
+    user = User.objects.create_user(username)
+    if balance is not None:
+        Wallet.objects.filter(user=user).update(balance=balance)
+    return User.objects.get(pk=user.pk)
+
+
+def balance_of(user):
+    return Wallet.objects.values_list('balance', flat=True).get(user=user)
+
+
+def create_job_user(username, fail=False):
+    # A job handler: its write has to commit or roll back with the job.
+    User.objects.create_user(username)
+    if fail:
+        raise RuntimeError("Handler failed.")
+
+
+def run_jobs():
+    while run_next() is not None:
+        pass
+
+
+class ParseAmountTests(TestCase):
+    def test_valid_amounts(self):
+        self.assertEqual(parse_amount('10'), Decimal('10.00'))
+        self.assertEqual(parse_amount('0.01'), Decimal('0.01'))
+        self.assertEqual(parse_amount(5), Decimal('5.00'))
+
+    def test_invalid_amounts(self):
+        for value in ['0', '-1', '0.001', 'abc', 'NaN', 'Infinity', '1e13', None, '']:
+            with self.subTest(value=value), self.assertRaises(InvalidAmount):
+                parse_amount(value)
+
+
+class DepositTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+
+    def test_deposit_credits_wallet_and_records_transaction(self):
+        deposit_funds(self.user, '25.50')
+        self.assertEqual(balance_of(self.user), Decimal('25.50'))
+        tx = Transaction.objects.get(wallet__user=self.user)
+        self.assertEqual((tx.transaction_type, tx.amount), ('deposit', Decimal('25.50')))
+
+    def test_invalid_deposit_changes_nothing(self):
+        with self.assertRaises(InvalidAmount):
+            deposit_funds(self.user, '-5')
+        self.assertEqual(balance_of(self.user), 0)
+        self.assertFalse(Transaction.objects.exists())
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice', balance=100)
+        self.bob = make_user('bob')
+
+    def test_transfer_moves_funds_and_records_both_sides(self):
+        transfer_funds(self.alice, self.bob.wallet.address, '30')
+        self.assertEqual(balance_of(self.alice), Decimal('70'))
+        self.assertEqual(balance_of(self.bob), Decimal('30'))
+        self.assertEqual(
+            sorted(Transaction.objects.values_list('wallet__user__username', 'transaction_type', 'amount')),
+            [('alice', 'transfer', Decimal('30.00')), ('bob', 'receive', Decimal('30.00'))],
+        )
+
+    def test_rejected_transfers_change_nothing(self):
+        cases = [
+            (self.bob.wallet.address, '100.01', InsufficientBalance),
+            (self.alice.wallet.address, '1', TransferError),
+            ('00000000-0000-0000-0000-000000000000', '1', WalletNotFound),
+            ('not-an-address', '1', WalletNotFound),
+            (self.bob.wallet.address, '0', InvalidAmount),
+        ]
+        for address, amount, error in cases:
+            with self.subTest(address=address, amount=amount), self.assertRaises(error):
+                transfer_funds(self.alice, address, amount)
+        self.assertEqual(balance_of(self.alice), Decimal('100'))
+        self.assertEqual(balance_of(self.bob), 0)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_transfer_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.post('/api/wallet/transfer/', {'receiver_address': str(self.bob.wallet.address), 'amount': '12.5'})
+        self.assertEqual(response.status_code, 200)
+        response = client.post('/api/wallet/transfer/', {'receiver_address': str(self.bob.wallet.address), 'amount': '1000'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(balance_of(self.bob), Decimal('12.5'))
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        deposit_funds(self.alice, '100')
+        transfer_funds(self.alice, self.bob.wallet.address, '30')
+        batch_transfer(self.alice, [{'receiver_address': str(self.bob.wallet.address), 'amount': '5'}])
+
+    def reconcile(self, **kwargs):
+        wallet_ids = Wallet.objects.values_list('id', flat=True)
+        return reconcile_chunk(min(wallet_ids), max(wallet_ids), **kwargs)
+
+    def test_money_paths_post_balanced_entries(self):
+        self.assertEqual(ledger_imbalance(), 0)
+        self.assertEqual(self.reconcile(), ([], 0))
+        self.assertEqual(balance_as_of(self.alice.wallet, timezone.now()), Decimal('65'))
+        self.assertEqual(balance_as_of(self.bob.wallet, timezone.now()), Decimal('35'))
+
+    def test_balance_as_of_an_earlier_time(self):
+        deposited_at = LedgerEntry.objects.get(wallet=self.alice.wallet, entry_type='deposit').timestamp
+        self.assertEqual(balance_as_of(self.alice.wallet, deposited_at), Decimal('100'))
+
+    def test_drift_is_reported(self):
+        Wallet.objects.filter(user=self.bob).update(balance=40)
+        drift, _ = self.reconcile()
+        self.assertEqual([(row['wallet_id'], row['difference']) for row in drift], [(self.bob.wallet.id, Decimal('5'))])
+
+    def test_checkpoints_keep_incremental_runs_exact(self):
+        self.assertEqual(self.reconcile(checkpoint_interval=2), ([], 2))
+        checkpoint = BalanceCheckpoint.objects.get(wallet=self.alice.wallet)
+        self.assertEqual(checkpoint.balance, Decimal('65'))
+        deposit_funds(self.alice, '1')
+        self.assertEqual(self.reconcile(), ([], 0))
+        self.assertEqual(self.reconcile(full=True), ([], 0))
+        self.assertEqual(balance_as_of(self.alice.wallet, timezone.now()), Decimal('66'))
+        # Drift after a checkpoint is still caught by the incremental run.
+        Wallet.objects.filter(user=self.alice).update(balance=1)
+        self.assertEqual(len(self.reconcile()[0]), 1)
+
+    def test_entries_are_append_only(self):
+        entry = LedgerEntry.objects.first()
+        with self.assertRaises(ValidationError):
+            entry.save()
+        with self.assertRaises(ValidationError):
+            entry.delete()
+
+
+class BatchTransferTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice', balance=100)
+        self.bob = make_user('bob')
+        self.carol = make_user('carol')
+
+    def items(self, *pairs):
+        return [{'receiver_address': str(user.wallet.address), 'amount': amount} for user, amount in pairs]
+
+    def test_batch_moves_every_transfer(self):
+        sender_wallet, total, results = batch_transfer(
+            self.alice, self.items((self.bob, '10'), (self.carol, '20'), (self.bob, '5')),
+        )
+        self.assertEqual(total, Decimal('35'))
+        self.assertEqual(sender_wallet.balance, Decimal('65'))
+        self.assertEqual([result['status'] for result in results], ['ok'] * 3)
+        self.assertEqual(balance_of(self.bob), Decimal('15'))
+        self.assertEqual(balance_of(self.carol), Decimal('20'))
+        self.assertEqual(Transaction.objects.count(), 6)
+
+    def test_one_bad_item_rejects_the_whole_batch(self):
+        items = self.items((self.bob, '10'), (self.carol, '-1')) + [
+            {'receiver_address': '00000000-0000-0000-0000-000000000000', 'amount': '1'},
+            {'receiver_address': str(self.alice.wallet.address), 'amount': '1'},
+        ]
+        with self.assertRaises(BatchTransferError) as raised:
+            batch_transfer(self.alice, items)
+        self.assertEqual(
+            [result['status'] for result in raised.exception.results], ['ok', 'error', 'error', 'error'],
+        )
+        self.assertEqual(balance_of(self.alice), Decimal('100'))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_batch_over_the_balance_is_rejected(self):
+        with self.assertRaises(BatchTransferError):
+            batch_transfer(self.alice, self.items((self.bob, '60'), (self.carol, '60')))
+        self.assertEqual(balance_of(self.alice), Decimal('100'))
+        self.assertEqual(balance_of(self.bob), 0)
+
+    def test_batch_size_is_limited(self):
+        for items in [[], 'nope', self.items(*[(self.bob, '0.01')] * (MAX_BATCH_TRANSFER_SIZE + 1))]:
+            with self.subTest(size=len(items)), self.assertRaises(TransferError):
+                batch_transfer(self.alice, items)
+
+    def test_batch_endpoint_reports_item_errors(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.post(
+            '/api/wallet/transfer/batch/',
+            {'transfers': self.items((self.bob, '10')) + [{'receiver_address': 'x', 'amount': '1'}]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][1]['status'], 'error')
+        response = client.post('/api/wallet/transfer/batch/', {'transfers': self.items((self.bob, '10'))}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['new_balance'], '90.00')
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.carol = make_user('carol')
+        self.at(datetime(2025, 3, 1, 9), deposit_funds, self.carol, '20')
+        self.at(datetime(2025, 3, 1, 10), deposit_funds, self.alice, '100')
+        self.at(datetime(2025, 3, 1, 11), transfer_funds, self.alice, self.bob.wallet.address, '30.10')
+        self.at(datetime(2025, 3, 2, 10), transfer_funds, self.carol, self.alice.wallet.address, '5.05')
+        self.at(datetime(2025, 3, 2, 11), transfer_funds, self.alice, self.carol.wallet.address, '10')
+        self.at(datetime(2025, 3, 2, 12), transfer_funds, self.alice, self.bob.wallet.address, '0.01')
+        self.at(datetime(2025, 3, 4, 10), deposit_funds, self.alice, '0.03')
+
+    def at(self, when, operation, *args):
+        # Backdates the transactions and ledger entries the operation writes.
+        started = timezone.now()
+        operation(*args)
+        when = when.replace(tzinfo=dt_timezone.utc)
+        Transaction.objects.filter(timestamp__gte=started).update(timestamp=when)
+        LedgerEntry.objects.filter(timestamp__gte=started).update(timestamp=when)
+
+    def analytics(self, user, start_date=None, end_date=None, top=10):
+        return wallet_analytics(Wallet.objects.get(user=user), start_date, end_date, top)
+
+    def test_whole_history(self):
+        result = self.analytics(self.alice)
+        self.assertEqual(
+            (result['opening_balance'], result['closing_balance'], result['total_inflow'], result['total_outflow']),
+            ('0.00', '64.97', '105.08', '40.11'),
+        )
+        self.assertEqual(result['transaction_count'], 6)
+        self.assertEqual(result['daily'], [
+            {'date': '2025-03-01', 'inflow': '100.00', 'outflow': '30.10', 'net': '69.90', 'balance': '69.90'},
+            {'date': '2025-03-02', 'inflow': '5.05', 'outflow': '10.01', 'net': '-4.96', 'balance': '64.94'},
+            {'date': '2025-03-04', 'inflow': '0.03', 'outflow': '0.00', 'net': '0.03', 'balance': '64.97'},
+        ])
+        self.assertEqual(result['top_counterparties'], [
+            {'wallet_address': str(self.bob.wallet.address), 'username': 'bob',
+             'sent': '30.11', 'received': '0.00', 'transactions': 2},
+            {'wallet_address': str(self.carol.wallet.address), 'username': 'carol',
+             'sent': '10.00', 'received': '5.05', 'transactions': 2},
+        ])
+        self.assertEqual([peer['username'] for peer in self.analytics(self.alice, top=1)['top_counterparties']], ['bob'])
+
+    def test_range_opens_with_the_ledger_balance(self):
+        result = self.analytics(self.alice, date(2025, 3, 2), date(2025, 3, 3))
+        self.assertEqual((result['opening_balance'], result['closing_balance']), ('69.90', '64.94'))
+        self.assertEqual(result['transaction_count'], 3)
+        self.assertEqual([day['balance'] for day in result['daily']], ['64.94'])
+
+    def test_empty_wallet(self):
+        result = self.analytics(make_user('dave'))
+        self.assertEqual((result['opening_balance'], result['closing_balance'], result['transaction_count']), ('0.00', '0.00', 0))
+        self.assertEqual((result['daily'], result['top_counterparties']), ([], []))
+        result = self.analytics(self.alice, date(2025, 3, 3), date(2025, 3, 3))
+        self.assertEqual((result['opening_balance'], result['closing_balance'], result['daily']), ('64.94', '64.94', []))
+
+    def test_new_transaction_changes_the_cache_key(self):
+        wallet = Wallet.objects.get(user=self.alice)
+        wallet_analytics(wallet)
+        # A cache hit costs only the query for the newest transaction id.
+        with self.assertNumQueries(1):
+            self.assertEqual(wallet_analytics(wallet)['closing_balance'], '64.97')
+        deposit_funds(self.alice, '1')
+        self.assertEqual(self.analytics(self.alice)['closing_balance'], '65.97')
+
+    def test_endpoint_validates_parameters(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.get('/api/wallet/analytics/?start_date=2025-03-02&end_date=2025-03-02')
+        self.assertEqual((response.status_code, response.data['closing_balance']), (200, '64.94'))
+        for query in ['start_date=March', 'start_date=2025-03-03&end_date=2025-03-01', 'top=0', 'top=101', 'top=x']:
+            with self.subTest(query=query):
+                self.assertEqual(client.get(f'/api/wallet/analytics/?{query}').status_code, 400)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def deposit(self, amount, key, client=None):
+        return (client or self.client).post('/api/wallet/deposit/', {'amount': amount}, headers={'Idempotency-Key': key})
+
+    def test_retry_replays_the_first_response(self):
+        first = self.deposit('10', 'key-1')
+        second = self.deposit('10', 'key-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((second.status_code, second.data), (200, first.data))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(balance_of(self.alice), Decimal('10'))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_reused_key_with_a_different_request_is_rejected(self):
+        self.deposit('10', 'key-1')
+        self.assertEqual(self.deposit('11', 'key-1').status_code, 422)
+        self.assertEqual(balance_of(self.alice), Decimal('10'))
+
+    def test_failed_attempts_can_be_retried(self):
+        transfer = {'receiver_address': str(self.bob.wallet.address), 'amount': '5'}
+        headers = {'Idempotency-Key': 'transfer-1'}
+        self.assertEqual(self.client.post('/api/wallet/transfer/', transfer, headers=headers).status_code, 400)
+        deposit_funds(self.alice, '5')
+        self.assertEqual(self.client.post('/api/wallet/transfer/', transfer, headers=headers).status_code, 200)
+        replay = self.client.post('/api/wallet/transfer/', transfer, headers=headers)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(balance_of(self.bob), Decimal('5'))
+
+    def test_keys_are_scoped_to_the_user(self):
+        other = APIClient()
+        other.force_authenticate(self.bob)
+        self.deposit('10', 'key-1')
+        response = self.deposit('10', 'key-1', client=other)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(balance_of(self.bob), Decimal('10'))
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        self.client.post('/api/wallet/deposit/', {'amount': '10'})
+        self.client.post('/api/wallet/deposit/', {'amount': '10'})
+        self.assertEqual(balance_of(self.alice), Decimal('20'))
+
+    def test_overlong_key_is_rejected(self):
+        self.assertEqual(self.deposit('10', 'k' * 256).status_code, 400)
+
+    def expire(self, key):
+        expired = timezone.now() - IDEMPOTENCY_KEY_TTL - timedelta(seconds=1)
+        IdempotencyKey.objects.filter(key=key).update(created_at=expired)
+
+    def test_expired_key_runs_as_a_new_request(self):
+        self.deposit('10', 'key-1')
+        self.expire('key-1')
+        response = self.deposit('11', 'key-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(balance_of(self.alice), Decimal('21'))
+        self.assertEqual(self.deposit('11', 'key-1')['Idempotent-Replayed'], 'true')
+
+    def test_purge_deletes_only_expired_keys(self):
+        for key in ['old-1', 'old-2', 'fresh']:
+            self.deposit('1', key)
+        self.expire('old-1')
+        self.expire('old-2')
+        out = io.StringIO()
+        call_command('purge_idempotency_keys', batch_size=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Deleted 2 expired idempotency keys.")
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['fresh'])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Row locks are only exercised on PostgreSQL.")
+class ConcurrentTransferTests(TransactionTestCase):
+    THREADS = 8
+    TRANSFERS_PER_THREAD = 25
+
+    def test_opposite_transfers_conserve_balance_without_deadlocks(self):
+        alice = make_user('alice', balance=1000)
+        bob = make_user('bob', balance=1000)
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def run(sender, receiver):
+            try:
+                start.wait()
+                for _ in range(self.TRANSFERS_PER_THREAD):
+                    transfer_funds(sender, receiver.wallet.address, '1')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        # Half the threads send alice -> bob and half bob -> alice, so without
+        # ordered locks pairs of transfers would wait on each other.
+        threads = [
+            threading.Thread(target=run, args=(alice, bob) if index % 2 else (bob, alice))
+            for index in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(balance_of(alice) + balance_of(bob), Decimal('2000'))
+        self.assertEqual(balance_of(alice), Decimal('1000'))
+        self.assertEqual(
+            Transaction.objects.filter(transaction_type='transfer').count(),
+            self.THREADS * self.TRANSFERS_PER_THREAD,
+        )
+
+
+class TransactionHistoryTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        # A real token, so the async view serves these under ASYNC_READ_VIEWS too.
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {WalletRefreshToken.for_user(self.alice).access_token}')
+        rows = Transaction.objects.bulk_create([
+            Transaction(wallet=self.alice.wallet, transaction_type='deposit', amount=amount) for amount in range(1, 6)
+        ])
+        self.ids = [row.pk for row in rows]
+        # Equal timestamps: the id has to break the tie between pages.
+        Transaction.objects.update(timestamp=timezone.now())
+        Transaction.objects.create(wallet=make_user('bob').wallet, transaction_type='deposit', amount=9)
+
+    def test_cursor_walks_every_row_once_newest_first(self):
+        seen = []
+        url = '/api/wallet/transactions/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['results']), 2)
+            seen.extend(row['id'] for row in page['results'])
+            url = page['next']
+            self.assertEqual(url is None, page['next_cursor'] is None)
+        self.assertEqual(seen, self.ids[::-1])
+
+    def test_page_size_bounds(self):
+        for page_size, expected in [('0', 5), ('-1', 5), ('abc', 5), ('3', 3)]:
+            with self.subTest(page_size=page_size):
+                response = self.client.get(f'/api/wallet/transactions/?page_size={page_size}')
+                self.assertEqual(len(response.json()['results']), expected)
+        request = Request(APIRequestFactory().get('/', {'page_size': '100000'}))
+        self.assertEqual(KeysetPagination().get_page_size(request), KeysetPagination.max_page_size)
+
+    def test_invalid_cursor(self):
+        for cursor in ['garbage', 'bm90LWEtY3Vyc29y']:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/api/wallet/transactions/?cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(TestCase):
+    def test_csv_streams_wallet_rows_in_order(self):
+        alice = make_user('alice')
+        bob = make_user('bob')
+        deposit_funds(alice, '100')
+        transfer_funds(alice, bob.wallet.address, '30')
+        client = APIClient()
+        client.force_authenticate(alice)
+
+        response = client.get('/api/wallet/export/csv/')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="transactions.csv"')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        alice_address, bob_address = str(alice.wallet.address), str(bob.wallet.address)
+        self.assertEqual(rows[0], EXPORT_COLUMNS)
+        self.assertEqual([row[1:8] for row in rows[1:]], [
+            [alice_address, '', '', '', '', 'deposit', '100.00'],
+            [alice_address, alice_address, 'alice', bob_address, 'bob', 'transfer', '30.00'],
+        ])
+
+        response = client.get('/api/wallet/export/csv/?transaction_type=transfer')
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 2)
+        response = client.get('/api/wallet/export/csv/?min_amount=abc')
+        self.assertEqual(response.status_code, 400)
+
+    def test_ndjson_keeps_microseconds(self):
+        alice = make_user('alice')
+        timestamp = datetime(2025, 3, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        Transaction.objects.create(wallet=alice.wallet, transaction_type='deposit', amount=5)
+        Transaction.objects.update(timestamp=timestamp)
+        lines = ''.join(stream_ndjson(export_rows(Transaction.objects.all()))).splitlines()
+        record = json.loads(lines[0])
+        self.assertEqual(datetime.fromisoformat(record['timestamp']), timestamp)
+        self.assertEqual(record['amount'], '5.00')
+
+
+class ChatListTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {WalletRefreshToken.for_user(self.alice).access_token}')
+
+    def chats(self):
+        response = self.client.get('/api/messages/chats/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_one_entry_per_pair_with_the_newest_message(self):
+        send_message(self.alice, self.bob, text='zzz')
+        send_message(self.bob, self.alice, text='aaa')
+        chats = self.chats()
+        self.assertEqual(len(chats), 1)
+        self.assertEqual(chats[0]['username'], 'bob')
+        self.assertEqual(chats[0]['wallet_address'], str(self.bob.wallet.address))
+        self.assertEqual((chats[0]['last_message'], chats[0]['unread_count']), ('aaa', 1))
+
+    def test_query_count_does_not_grow_with_chats(self):
+        send_message(self.alice, self.bob, text='hi')
+        with CaptureQueriesContext(connection) as one_chat:
+            self.chats()
+        for index in range(5):
+            send_message(make_user(f'friend-{index}'), self.alice, text='hi')
+        with CaptureQueriesContext(connection) as six_chats:
+            self.assertEqual(len(self.chats()), 6)
+        self.assertEqual(len(six_chats), len(one_chat))
+
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+
+    def conversation(self):
+        return Conversation.objects.get()
+
+    def unread_for(self, user):
+        conversation = self.conversation()
+        return conversation.unread_low if conversation.user_low_id == user.pk else conversation.unread_high
+
+    def test_messages_upsert_one_row_per_pair(self):
+        first = send_message(self.alice, self.bob, text='one')
+        self.assertEqual(self.conversation().last_message_id, first.pk)
+        send_message(self.bob, self.alice, text='two')
+        third = send_message(self.bob, self.alice, text='three')
+        self.assertEqual(Conversation.objects.count(), 1)
+        conversation = self.conversation()
+        self.assertEqual((conversation.user_low_id, conversation.user_high_id), (self.alice.pk, self.bob.pk))
+        self.assertEqual(conversation.last_message_preview, 'three')
+        self.assertEqual(conversation.last_message_id, third.pk)
+        self.assertEqual((self.unread_for(self.alice), self.unread_for(self.bob)), (2, 1))
+
+    def test_last_message_only_moves_forward(self):
+        newer = send_message(self.alice, self.bob, text='newer')
+        # A message that commits after a newer one was already recorded.
+        older = Message.objects.create(sender=self.bob, receiver=self.alice, text='older')
+        Message.objects.filter(pk=older.pk).update(timestamp=newer.timestamp - timedelta(seconds=1))
+        older.refresh_from_db()
+        record_message(older)
+        conversation = self.conversation()
+        self.assertEqual((conversation.last_message_id, conversation.last_message_preview), (newer.pk, 'newer'))
+        self.assertEqual(conversation.last_timestamp, newer.timestamp)
+        self.assertEqual(self.unread_for(self.alice), 1)
+
+    def test_unread_count_drops_by_rows_actually_marked(self):
+        messages = [send_message(self.alice, self.bob, text=str(index)) for index in range(3)]
+        stale = Message.objects.get(pk=messages[0].pk)
+        self.assertEqual(mark_messages_read(self.bob, self.alice, messages[:2]), 2)
+        self.assertEqual(self.unread_for(self.bob), 1)
+        # Another request already marked this row; the counter must not drop again.
+        self.assertEqual(mark_messages_read(self.bob, self.alice, [stale]), 0)
+        self.assertEqual(self.unread_for(self.bob), 1)
+        # The sender reading their own messages changes nothing.
+        self.assertEqual(mark_messages_read(self.alice, self.bob, messages), 0)
+
+    def test_backfill_matches_incremental_rows(self):
+        send_message(self.alice, self.bob, text='hi')
+        send_message(self.bob, self.alice, text='hello')
+        carol = make_user('carol')
+        send_message(carol, self.alice, text='hey')
+        expected = sorted(Conversation.objects.values_list(
+            'user_low', 'user_high', 'last_message', 'last_message_preview', 'unread_low', 'unread_high',
+        ))
+        Conversation.objects.filter(user_high=carol).delete()
+        Conversation.objects.update(last_message_preview='stale', unread_low=9)
+
+        self.assertEqual(backfill_conversations(chunk_size=1), 2)
+        self.assertEqual(sorted(Conversation.objects.values_list(
+            'user_low', 'user_high', 'last_message', 'last_message_preview', 'unread_low', 'unread_high',
+        )), expected)
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+        self.url = f'/api/messages/chat/{self.alice.wallet.address}/'
+        self.messages = [send_message(self.alice, self.bob, text=str(index)) for index in range(5)]
+        self.ids = [message.pk for message in self.messages]
+        # Equal timestamps: the id breaks the tie in the scroll-back cursor.
+        Message.objects.update(timestamp=timezone.now())
+
+    def test_without_parameters_returns_the_whole_chat(self):
+        response = self.client.get(self.url)
+        self.assertEqual([message['id'] for message in response.data], self.ids)
+        self.assertFalse(Message.objects.filter(is_read=False).exists())
+        self.assertEqual(Conversation.objects.values_list('unread_high', 'unread_low').get(), (0, 0))
+
+    def test_scroll_back_with_before_cursor(self):
+        pages = []
+        url = f'{self.url}?limit=2'
+        while url:
+            response = self.client.get(url)
+            pages.append([message['id'] for message in response.data['results']])
+            cursor = response.data['previous_cursor']
+            self.assertEqual(cursor is not None, response.data['has_more'])
+            url = f'{self.url}?limit=2&before={cursor}' if cursor else None
+        self.assertEqual(pages, [self.ids[3:], self.ids[1:3], self.ids[:1]])
+        # Only the pages actually returned were marked read, all of them here.
+        self.assertFalse(Message.objects.filter(is_read=False).exists())
+
+    def test_incremental_sync_with_after(self):
+        response = self.client.get(f'{self.url}?after={self.ids[1]}&limit=2')
+        self.assertEqual([message['id'] for message in response.data['results']], self.ids[2:4])
+        self.assertEqual((response.data['has_more'], response.data['last_id']), (True, self.ids[3]))
+        self.assertEqual(Message.objects.filter(is_read=False).count(), 3)
+
+        response = self.client.get(f'{self.url}?after={self.ids[4]}')
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual((response.data['has_more'], response.data['last_id']), (False, self.ids[4]))
+
+    def test_invalid_parameters(self):
+        for query in ['limit=0', 'limit=x', 'after=x', 'before=garbage']:
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f'{self.url}?{query}').status_code, 400)
+        response = self.client.get('/api/messages/chat/00000000-0000-0000-0000-000000000000/')
+        self.assertEqual(response.status_code, 404)
+
+
+class StatisticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed(users=5, transactions=500, messages=200, days=400)
+
+    def cents(self, result):
+        return {key: Decimal(value).quantize(Decimal('0.01')) for key, value in result.items()}
+
+    def test_live_and_rollup_match_the_per_window_queries_in_fewer_queries(self):
+        with self.assertNumQueries(9):
+            legacy = legacy_statistics()
+        with self.assertNumQueries(2):
+            live = live_statistics()
+        with self.assertNumQueries(1):
+            rollup = rollup_statistics()
+        self.assertNotEqual(legacy['transaction_count_year'], 0)
+        self.assertEqual(self.cents(live), self.cents(legacy))
+        self.assertEqual(self.cents(rollup), self.cents(legacy))
+
+
+class JobTests(TestCase):
+    def test_claims_due_jobs_in_order(self):
+        later = enqueue(create_job_user, username='later')
+        Job.objects.filter(pk=later.pk).update(run_at=timezone.now() + timedelta(hours=1))
+        enqueue(create_job_user, username='first')
+        enqueue(create_job_user, username='second')
+        failed = enqueue(create_job_user, username='failed')
+        Job.objects.filter(pk=failed.pk).update(status='failed')
+
+        self.assertEqual(run_next().payload, {'username': 'first'})
+        self.assertTrue(User.objects.filter(username='first').exists())
+        self.assertEqual(run_next().payload, {'username': 'second'})
+        self.assertIsNone(run_next())
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {later.pk, failed.pk})
+
+    def test_failed_handler_rolls_back_and_retries_with_backoff(self):
+        job = enqueue(create_job_user, username='erin', fail=True)
+        before = timezone.now()
+        with self.assertLogs('myapp.jobs', 'ERROR'):
+            self.assertEqual(run_next().pk, job.pk)
+
+        self.assertFalse(User.objects.filter(username='erin').exists())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn("RuntimeError: Handler failed.", job.last_error)
+        self.assertGreaterEqual(job.run_at, before + retry_delay(1))
+        self.assertIsNone(run_next())
+        self.assertEqual([retry_delay(attempts).total_seconds() for attempts in (1, 2, 3, 20)], [10, 20, 40, 3600])
+
+    def test_job_fails_after_max_attempts(self):
+        job = enqueue(create_job_user, max_attempts=2, username='erin', fail=True)
+        with self.assertLogs('myapp.jobs', 'ERROR'):
+            for _ in range(2):
+                Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+                run_next()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertIsNone(run_next())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "SKIP LOCKED is checked against PostgreSQL.")
+class ConcurrentJobTests(TransactionTestCase):
+    def test_jobs_locked_by_another_worker_are_skipped(self):
+        first = enqueue(create_job_user, username='first')
+        enqueue(create_job_user, username='second')
+        locked, release = threading.Event(), threading.Event()
+
+        def claim():
+            try:
+                with transaction.atomic():
+                    Job.objects.select_for_update().get(pk=first.pk)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=claim)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            self.assertEqual(run_next().payload, {'username': 'second'})
+            self.assertIsNone(run_next())
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(run_next().payload, {'username': 'first'})
+
+
+class StatisticsJobTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+
+    def test_rebuild_leaves_queued_increments_to_their_jobs(self):
+        deposit_funds(self.alice, '10.00')
+        run_jobs()
+        deposit_funds(self.alice, '5.00')
+        send_message(self.alice, self.bob, text='hi')
+        failed = enqueue(create_job_user, username='unrelated')
+        Job.objects.filter(pk=failed.pk).update(status='failed')
+
+        rebuild_statistics(7)
+        rollup = rollup_statistics()
+        self.assertEqual((rollup['transaction_count_week'], rollup['message_count_week']), (1, 0))
+        self.assertEqual(rollup['transaction_volume_week'], Decimal('10.00'))
+
+        run_jobs()
+        self.assertEqual(rollup_statistics(), live_statistics())
+        self.assertEqual(live_statistics()['transaction_count_week'], 2)
+
+    def test_rebuild_counts_rows_of_failed_increments(self):
+        deposit_funds(self.alice, '10.00')
+        Job.objects.update(status='failed')
+        self.assertEqual(rollup_statistics()['transaction_count_week'], 0)
+        rebuild_statistics(7)
+        self.assertEqual(rollup_statistics(), live_statistics())
+
+    def test_rollup_response_reports_pending_updates(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        deposit_funds(self.alice, '10.00')
+        send_message(self.alice, self.bob, text='hi')
+
+        data = client.get('/api/statistics/').json()
+        self.assertEqual((data['pending_updates'], data['failed_updates'], data['transaction_count_week']), (2, 0, 0))
+        self.assertIsNotNone(data['pending_since'])
+        Job.objects.update(status='failed')
+        self.assertEqual(pending_statistics(), {'pending_updates': 0, 'pending_since': None, 'failed_updates': 2})
+        Job.objects.update(status='queued')
+
+        run_jobs()
+        data = client.get('/api/statistics/').json()
+        self.assertEqual((data['pending_updates'], data['pending_since'], data['transaction_count_week']), (0, None, 1))
+        self.assertNotIn('pending_updates', client.get('/api/statistics/', {'source': 'live'}).json())
+
+
+class WebSocketTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+
+    async def test_valid_token_is_accepted_and_receives_events(self):
+        subscribers = get_broker().subscriber_count()
+        client = Client(websocket_application, AccessToken.for_user(self.user))
+        self.assertTrue(await client.accepted())
+        get_broker().publish(user_topic(self.user.pk), {'type': 'test'})
+        message = await client.sent.get()
+        self.assertEqual(message['text'], '{"type": "test"}')
+        await client.close()
+        self.assertEqual(get_broker().subscriber_count(), subscribers)
+
+    async def test_invalid_token_is_refused(self):
+        client = Client(websocket_application, 'not-a-token')
+        self.assertFalse(await client.accepted())
+        await client.task
+
+
+class WalletCacheTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+
+    @contextlib.contextmanager
+    def shared_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+            with override_settings(CACHES={**settings.CACHES, 'wallets': shared}):
+                yield
+
+    def test_process_local_cache_reads_balances_from_the_database(self):
+        self.assertEqual(get_wallet_snapshot(self.user.pk)['balance'], 0)
+        # A write made by another worker, which cannot invalidate this cache.
+        Wallet.objects.filter(user=self.user).update(balance=7)
+        self.assertEqual(get_wallet_snapshot(self.user.pk)['balance'], 7)
+
+    def test_process_local_cache_reads_usernames_from_the_database(self):
+        address = self.user.wallet.address
+        self.assertEqual(get_user_by_address(address).username, 'alice')
+        User.objects.filter(pk=self.user.pk).update(username='alicia')
+        with self.assertNumQueries(0):
+            user = get_user_by_address(address)
+        self.assertEqual((user.pk, user.wallet.pk), (self.user.pk, self.user.wallet.pk))
+        self.assertEqual(user.username, 'alicia')
+
+    def test_shared_cache_is_invalidated_by_writes(self):
+        with self.shared_cache():
+            self.assertEqual(get_wallet_snapshot(self.user.pk)['balance'], 0)
+            Wallet.objects.filter(user=self.user).update(balance=7)
+            self.assertEqual(get_wallet_snapshot(self.user.pk)['balance'], 0)
+            deposit_funds(self.user, '3')
+            self.assertEqual(get_wallet_snapshot(self.user.pk)['balance'], 10)
+
+    def test_rename_through_claims_user_invalidates_address(self):
+        bob = make_user('bob')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        start_chat = {'receiver_wallet': str(bob.wallet.address)}
+        with self.shared_cache():
+            self.assertEqual(client.post('/api/messages/start_chat/', start_chat, format='json').data['username'], 'bob')
+
+            # Bob's own request runs as the ClaimsUser built from his token.
+            bob_client = APIClient()
+            bob_client.credentials(HTTP_AUTHORIZATION=f'Bearer {WalletRefreshToken.for_user(bob).access_token}')
+            response = bob_client.put('/api/profile/', {'username': 'bobby'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(client.post('/api/messages/start_chat/', start_chat, format='json').data['username'], 'bobby')
+
+
+class WalletEventsTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.deposit = Transaction.objects.create(wallet=self.user.wallet, transaction_type='deposit', amount=5)
+
+    def test_event_stream_needs_asgi(self):
+        response = self.client.get('/api/wallet/events/', headers=self.headers)
+        self.assertEqual(response.status_code, 501)
+
+    def test_long_poll_works_under_wsgi(self):
+        response = self.client.get('/api/wallet/events/?mode=poll&since=0', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event['id'] for event in response.json()['events']], [self.deposit.pk])
+        response = self.client.get(f'/api/wallet/events/?mode=poll&since={self.deposit.pk}&timeout=0', headers=self.headers)
+        self.assertEqual(response.status_code, 204)
+
+    async def test_event_stream_replays_missed_events(self):
+        response = await AsyncClient().get('/api/wallet/events/?since=0', headers=self.headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b': connected\n\n')
+        self.assertTrue((await anext(chunks)).startswith(f'id: {self.deposit.pk}\nevent: deposit\n'.encode()))
+        # A client disconnect cancels the pending read, which must unsubscribe.
+        subscribers = get_broker().subscriber_count()
+        pending = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(get_broker().subscriber_count(), subscribers - 1)
+
+
+class ImportUsersTests(TestCase):
+    def import_file(self, name, content):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/{name}'
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            out = io.StringIO()
+            call_command('import_users', path, workers=1, chunk_size=2, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_csv_import(self):
+        make_user('carol')
+        output = self.import_file('users.csv', (
+            'username,email,password\n'
+            'alice,alice@example.com,s3cret-pass\n'
+            'bob,,\n'
+            'alice,again@example.com,other\n'
+            ',nobody@example.com,x\n'
+            'carol,carol@example.com,x\n'
+        ))
+        self.assertTrue(output.startswith('Imported 2 users and skipped 3'))
+        alice = User.objects.get(username='alice')
+        self.assertEqual(alice.email, 'alice@example.com')
+        self.assertTrue(alice.check_password('s3cret-pass'))
+        self.assertFalse(User.objects.get(username='bob').has_usable_password())
+        self.assertEqual(
+            sorted(Wallet.objects.values_list('user__username', flat=True)), ['alice', 'bob', 'carol'],
+        )
+
+    def test_ndjson_skips_rows_that_are_not_objects(self):
+        output = self.import_file('users.ndjson', (
+            '[]\n"x"\nnull\n\n{"username": 5}\n{"username": "dave", "email": null, "password": "pw-1234"}\n'
+        ))
+        self.assertTrue(output.startswith('Imported 1 users and skipped 4'))
+        self.assertTrue(User.objects.get(username='dave').check_password('pw-1234'))
+        self.assertEqual(Wallet.objects.filter(user__username='dave').count(), 1)
+
+    def test_invalid_json_is_reported(self):
+        with self.assertRaises(CommandError):
+            self.import_file('users.ndjson', '{"username": "erin"\n')
+
+    def test_username_taken_during_the_import_is_skipped(self):
+        class RacingPool:
+            # Another process registers "erin" while the chunk is hashing.
+            def map(self, function, passwords, chunksize):
+                make_user('erin')
+                return map(function, passwords)
+
+        rows = [{'username': 'erin'}, {'username': 'frank'}]
+        self.assertEqual(import_chunk(rows, RacingPool(), 1, set()), (1, 1))
+        self.assertEqual(Wallet.objects.filter(user__username__in=['erin', 'frank']).count(), 2)
+
+
+class WalletlessLoginTests(TestCase):
+    # Superusers and partially imported users have no wallet.
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', password='correct horse')
+        Wallet.objects.filter(user=self.user).delete()
+
+    def test_login_issues_tokens_without_wallet_claims(self):
+        response = self.client.post(
+            '/api/login/', {'username': 'admin', 'password': 'correct horse'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        access = AccessToken(response.json()['access'])
+        self.assertNotIn(WALLET_ADDRESS_CLAIM, access.payload)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(client.get('/api/profile/').data['username'], 'admin')
+        response = self.client.post('/api/token/refresh/', {'refresh': response.json()['refresh']})
+        self.assertEqual(response.status_code, 200)
+
+    async def test_async_login(self):
+        request = AsyncRequestFactory().post(
+            '/api/login/', {'username': 'admin', 'password': 'correct horse'}, content_type='application/json',
+        )
+        response = await token_obtain_pair(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(WALLET_ADDRESS_CLAIM, AccessToken(json.loads(response.content)['access']).payload)
+
+
+class AsyncLoginTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='correct horse')
+
+    async def login(self, body, content_type='application/json'):
+        request = AsyncRequestFactory().post('/api/login/', body, content_type=content_type)
+        return await token_obtain_pair(request)
+
+    def test_mounted_for_async_views(self):
+        views = {pattern.name: pattern.callback for pattern in with_async_views(sync_urlpatterns)}
+        self.assertIs(views['token_obtain_pair'], token_obtain_pair)
+
+    async def test_issues_tokens_with_wallet_claims(self):
+        response = await self.login({'username': 'alice', 'password': 'correct horse'})
+        self.assertEqual(response.status_code, 200)
+        access = AccessToken(json.loads(response.content)['access'])
+        wallet = await Wallet.objects.aget(user=self.user)
+        self.assertEqual(access[WALLET_ADDRESS_CLAIM], str(wallet.address))
+
+    async def test_rejects_bad_credentials(self):
+        response = await self.login({'username': 'alice', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.login({'username': 'nobody', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.login({'username': 'alice'})
+        self.assertEqual(response.status_code, 400)
+        response = await self.login('username=alice', content_type='application/x-www-form-urlencoded')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_upgrades_outdated_hash(self):
+        outdated = make_password('correct horse', hasher='pbkdf2_sha256')
+        await User.objects.filter(pk=self.user.pk).aupdate(password=outdated)
+        response = await self.login({'username': 'alice', 'password': 'correct horse'})
+        self.assertEqual(response.status_code, 200)
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertTrue(user.password.startswith('argon2$'))
+
+
+class UploadTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(UPLOAD_PARTS_DIR=f'{directory.name}/parts', MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = make_user('alice')
+        self.bob = make_user('bob')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/messages/uploads/', {'file_name': 'notes.txt', 'size': 10}, format='json')
+        self.upload_id = response.data['upload_id']
+
+    def put(self, offset, body):
+        return self.client.generic(
+            'PUT', f'/api/messages/uploads/{self.upload_id}/', body,
+            content_type='application/octet-stream', headers={'Upload-Offset': str(offset)},
+        )
+
+    def test_parts_are_appended_in_order(self):
+        self.assertEqual(self.put(0, b'hello').status_code, 200)
+        self.assertEqual(self.put(0, b'HELLO').status_code, 409)
+        self.assertEqual(self.put(5, b'world').status_code, 200)
+        upload = Upload.objects.get(pk=self.upload_id)
+        self.assertEqual(upload.received, 10)
+        self.assertEqual(part_path(upload).read_bytes(), b'helloworld')
+
+    def test_dropped_connection_keeps_received_bytes(self):
+        upload = write_part(self.user, self.upload_id, 0, io.BytesIO(b'hel'), 5)
+        self.assertEqual(upload.received, 3)
+        with self.assertRaises(UploadConflict):
+            write_part(self.user, self.upload_id, 0, io.BytesIO(b'hello'), 5)
+        self.assertEqual(part_path(upload).read_bytes(), b'hel')
+        self.assertEqual(list(part_path(upload).parent.iterdir()), [part_path(upload)])
+
+    def test_repeated_complete_returns_the_same_message(self):
+        self.put(0, b'helloworld')
+        complete = f'/api/messages/uploads/{self.upload_id}/complete/'
+        body = {'receiver_wallet': str(self.bob.wallet.address)}
+        first = self.client.post(complete, body, format='json')
+        self.assertEqual(first.status_code, 201)
+        second = self.client.post(complete, body, format='json')
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(Message.objects.filter(sender=self.user).count(), 1)
+        self.assertEqual(Upload.objects.get(pk=self.upload_id).message_id, first.data['id'])
+
+    def test_expired_uploads_are_not_found_and_purged(self):
+        self.put(0, b'hello')
+        fresh = Upload.objects.create(user=self.user, file_name='new.txt', size=1)
+        part_path(fresh).touch()
+        Upload.objects.filter(pk=self.upload_id).update(created_at=timezone.now() - UPLOAD_EXPIRY)
+        self.assertEqual(self.client.get(f'/api/messages/uploads/{self.upload_id}/').status_code, 404)
+        self.assertEqual(self.put(5, b'world').status_code, 404)
+
+        expired = Upload.objects.get(pk=self.upload_id)
+        abandoned = part_path(expired).with_suffix('.1.receiving')
+        abandoned.touch()
+        os.utime(abandoned, (0, 0))
+        out = io.StringIO()
+        call_command('purge_uploads', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Deleted 1 expired uploads.")
+        self.assertEqual(list(Upload.objects.values_list('pk', flat=True)), [fresh.pk])
+        self.assertEqual(list(part_path(fresh).parent.iterdir()), [part_path(fresh)])
+
+
+class DownloadTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        stored = store_file(io.BytesIO(b'0123456789'))
+        self.etag = f'"{stored.sha256}"'
+        self.message = send_message(
+            self.alice, self.bob, text='', file=stored.file.name, stored_file=stored, file_name='notes.txt',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def download(self, message=None, **headers):
+        return self.client.get(f'/api/messages/file/{(message or self.message).pk}/', headers=headers)
+
+    def test_full_download(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual((response['ETag'], response['Accept-Ranges']), (self.etag, 'bytes'))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="notes.txt"')
+
+    def test_byte_ranges(self):
+        cases = [('bytes=2-5', b'2345', 'bytes 2-5/10'), ('bytes=-3', b'789', 'bytes 7-9/10'),
+                 ('bytes=8-', b'89', 'bytes 8-9/10'), ('bytes=5-100', b'56789', 'bytes 5-9/10')]
+        for header, content, content_range in cases:
+            with self.subTest(header=header):
+                response = self.download(Range=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b''.join(response.streaming_content), content)
+                self.assertEqual(response['Content-Range'], content_range)
+                self.assertEqual(response['Content-Length'], str(len(content)))
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response = self.download(Range='bytes=10-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+        self.assertEqual(self.download(Range='bytes=1-2,4-5').status_code, 200)
+
+    def test_conditional_requests(self):
+        self.assertEqual(self.download(**{'If-None-Match': self.etag}).status_code, 304)
+        self.assertEqual(self.download(**{'If-None-Match': f'W/{self.etag}'}).status_code, 304)
+        self.assertEqual(self.download(**{'If-None-Match': '"other"'}).status_code, 200)
+        self.assertEqual(self.download(Range='bytes=0-1', **{'If-Range': self.etag}).status_code, 206)
+        self.assertEqual(self.download(Range='bytes=0-1', **{'If-Range': '"other"'}).status_code, 200)
+
+    def test_weak_etag_never_allows_a_partial_response(self):
+        # Files sent before content addressing have only a size/mtime tag.
+        name = default_storage.save('messages/legacy.txt', ContentFile(b'abcdef'))
+        legacy = Message.objects.create(sender=self.alice, receiver=self.bob, file=name)
+        etag = self.download(legacy)['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        response = self.download(legacy, Range='bytes=0-1', **{'If-Range': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'abcdef')
+
+    def test_only_participants_can_download(self):
+        outsider = APIClient()
+        outsider.force_authenticate(make_user('carol'))
+        self.assertEqual(outsider.get(f'/api/messages/file/{self.message.pk}/').status_code, 404)
+        text_only = send_message(self.alice, self.bob, text='hi')
+        self.assertEqual(self.download(text_only).status_code, 404)
+
+    def test_offloaded_downloads(self):
+        with override_settings(FILE_DOWNLOAD_OFFLOAD='x-accel-redirect'):
+            response = self.download()
+            self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.message.file.name}')
+            self.assertEqual((response.content, response['ETag']), (b'', self.etag))
+        with override_settings(FILE_DOWNLOAD_OFFLOAD='x-sendfile'):
+            self.assertEqual(self.download()['X-Sendfile'], self.message.file.path)
+
+
+
+class PreviewTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def send_image(self, size=(600, 300), file_name='photo.png'):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        buffer.seek(0)
+        stored = store_file(buffer)
+        return send_message(
+            self.alice, self.bob, text='', file=stored.file.name, stored_file=stored, file_name=file_name,
+        )
+
+    def test_sending_queues_previews_and_the_job_records_metadata(self):
+        message = self.send_image()
+        self.assertTrue(Job.objects.filter(name=job_name(generate_previews), payload={'message_id': message.pk}).exists())
+        run_jobs()
+
+        message.refresh_from_db()
+        self.assertEqual((message.mime_type, message.width, message.height), ('image/png', 600, 300))
+        self.assertEqual(message.file_size, message.stored_file.size)
+        self.assertEqual(message.thumbnail.name, f'previews/{message.stored_file.sha256[:2]}/'
+                                                 f'{message.stored_file.sha256}-thumbnail.webp')
+        self.assertFalse(Job.objects.exists())
+
+    def test_shared_file_reuses_previews(self):
+        first, second = self.send_image(), self.send_image(file_name='copy.png')
+        self.assertEqual(first.stored_file_id, second.stored_file_id)
+        self.assertTrue(generate_previews(first.pk))
+        with mock.patch('myapp.previews._open_image') as open_image:
+            self.assertTrue(generate_previews(second.pk))
+        open_image.assert_not_called()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((second.thumbnail.name, second.preview.name), (first.thumbnail.name, first.preview.name))
+        self.assertEqual((second.width, second.height), (600, 300))
+        self.assertEqual(len(default_storage.listdir(os.path.dirname(first.thumbnail.name))[1]), 2)
+
+    def test_processed_messages_are_skipped(self):
+        message = self.send_image()
+        self.assertTrue(generate_previews(message.pk))
+        with mock.patch('myapp.previews._open_image') as open_image:
+            self.assertFalse(generate_previews(message.pk))
+            output = io.StringIO()
+            call_command('generate_previews', stdout=output)
+        open_image.assert_not_called()
+        self.assertEqual(output.getvalue().strip(), "Processed 0 attachments.")
+
+    def test_previews_are_served_to_participants_only(self):
+        message = self.send_image()
+        generate_previews(message.pk)
+        url = f'/api/messages/file/{message.pk}/'
+        data = self.client.get(f'/api/messages/chat/{self.alice.wallet.address}/').json()
+        self.assertEqual(data[-1]['thumbnail'], f'{url}?variant=thumbnail')
+
+        response = self.client.get(url, {'variant': 'thumbnail'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="photo-thumbnail.webp"')
+        self.assertEqual(response['ETag'], f'"{message.stored_file.sha256}-thumbnail"')
+        from PIL import Image
+
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).size, (256, 128))
+
+        self.assertEqual(self.client.get(url, {'variant': 'original'}).status_code, 400)
+        outsider = APIClient()
+        outsider.force_authenticate(make_user('carol'))
+        self.assertEqual(outsider.get(url, {'variant': 'thumbnail'}).status_code, 404)
+
+    def test_unprocessed_message_has_no_preview(self):
+        message = self.send_image()
+        response = self.client.get(f'/api/messages/file/{message.pk}/', {'variant': 'preview'})
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(MessageSerializer(message).data['preview'])
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Plans are checked against PostgreSQL.")
+class IndexUsageTests(TestCase):
+    # Enough rows for the planner's statistics to look like production: every
+    # pair has a short chat with only its oldest message unread, and the first
+    # wallet has a history many pages long.
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([User(username=f'user-{index}') for index in range(50)])
+        wallets = Wallet.objects.bulk_create([Wallet(user=user) for user in users])
+        Message.objects.bulk_create([
+            Message(sender=sender, receiver=receiver, text='hi', is_read=index > 0)
+            for sender in users for receiver in users if sender != receiver for index in range(4)
+        ])
+        Transaction.objects.bulk_create([
+            Transaction(wallet=wallet, transaction_type='deposit', amount=1)
+            for wallet in wallets for _ in range(2000 if wallet == wallets[0] else 40)
+        ])
+        cls.alice, cls.bob = users[:2]
+        cls.wallet = wallets[0]
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE myapp_message')
+            cursor.execute('ANALYZE myapp_transaction')
+
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(index, queryset.explain())
+
+    def test_transaction_history_uses_wallet_timestamp_index(self):
+        queryset = Transaction.objects.filter(wallet=self.wallet).order_by('-timestamp', '-id')[:50]
+        self.assertUsesIndex(queryset, 'tx_wallet_timestamp_idx')
+
+    def test_chat_history_uses_pair_timestamp_index(self):
+        queryset = Message.objects.filter(
+            Q(sender=self.alice, receiver=self.bob) | Q(sender=self.bob, receiver=self.alice)
+        ).order_by('timestamp', 'id')
+        self.assertUsesIndex(queryset, 'msg_pair_timestamp_idx')
+
+    def test_unread_count_uses_partial_index(self):
+        queryset = Message.objects.filter(receiver=self.alice, sender=self.bob, is_read=False)
+        self.assertUsesIndex(queryset, 'msg_unread_idx')
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Concurrent retries need PostgreSQL row locks.")
+class ConcurrentIdempotencyTests(TransactionTestCase):
+    def test_concurrent_retries_apply_once(self):
+        user = make_user('alice')
+        statuses = []
+        start = threading.Barrier(4)
+
+        def run():
+            try:
+                client = APIClient()
+                client.force_authenticate(user)
+                start.wait()
+                response = client.post('/api/wallet/deposit/', {'amount': '10'}, headers={'Idempotency-Key': 'key-1'})
+                statuses.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 4)
+        self.assertEqual(balance_of(user), Decimal('10'))
@@ -0,0 +1,61 @@
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import caches
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+WALLET_ID_CLAIM = 'wallet_id'
+WALLET_ADDRESS_CLAIM = 'wallet_address'
+
+
+class WalletRefreshToken(RefreshToken):
+    # Access tokens copy these claims from their refresh token, so the
+    # authentication fast path can build request.user without a query. Users
+    # without a wallet (superusers, partial imports) get tokens without them.
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        try:
+            wallet = user.wallet
+        except ObjectDoesNotExist:
+            return token
+        token[WALLET_ID_CLAIM] = wallet.pk
+        token[WALLET_ADDRESS_CLAIM] = str(wallet.address)
+        return token
+
+
+class WalletTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = WalletRefreshToken
+
+
+def _denylist():
+    return caches[getattr(settings, 'TOKEN_DENYLIST_CACHE_ALIAS', 'default')]
+
+
+def _denylist_key(jti):
+    return f'token:denied:{jti}'
+
+
+def revoke_token(token):
+    # Entries only need to live as long as the token would.
+    remaining = token['exp'] - datetime.now(tz=timezone.utc).timestamp()
+    if remaining > 0:
+        _denylist().set(_denylist_key(token[api_settings.JTI_CLAIM]), True, int(remaining) + 1)
+
+
+def is_revoked(token):
+    return _denylist().get(_denylist_key(token.get(api_settings.JTI_CLAIM))) is not None
+
+
+async def ais_revoked(token):
+    return await _denylist().aget(_denylist_key(token.get(api_settings.JTI_CLAIM))) is not None
+
+
+class DenylistTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        if is_revoked(self.token_class(attrs['refresh'])):
+            raise InvalidToken("Token has been revoked.")
+        return super().validate(attrs)
@@ -0,0 +1,212 @@
+import hashlib
+import os
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .conversations import send_message
+from .models import StoredFile, Upload
+
+MAX_UPLOAD_SIZE = 1024 ** 3
+MAX_UPLOAD_PART_SIZE = 16 * 1024 * 1024
+COPY_CHUNK_SIZE = 64 * 1024
+# Uploads must be completed within this long of starting. Older ones are not
+# found any more and ``manage.py purge_uploads`` deletes their rows and files.
+UPLOAD_EXPIRY = timedelta(days=1)
+PURGE_BATCH_SIZE = 1000
+
+
+class UploadError(Exception):
+    status_code = 400
+
+
+class UploadNotFound(UploadError):
+    status_code = 404
+
+
+class UploadConflict(UploadError):
+    status_code = 409
+
+
+def _parts_dir():
+    path = Path(getattr(settings, 'UPLOAD_PARTS_DIR', Path(settings.BASE_DIR) / 'upload_parts'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def part_path(upload):
+    return _parts_dir() / f'{upload.pk}.part'
+
+
+def expiry_cutoff():
+    return timezone.now() - UPLOAD_EXPIRY
+
+
+def content_name(sha256):
+    return f'files/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def _digest(fileobj):
+    digest = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    while chunk := fileobj.read(COPY_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+
+def store_file(fileobj):
+    # Returns the StoredFile for these bytes, writing them to storage only the
+    # first time they are seen.
+    sha256, size = _digest(fileobj)
+    stored = StoredFile.objects.filter(sha256=sha256).first()
+    if stored is not None:
+        return stored
+
+    name = default_storage.save(content_name(sha256), File(fileobj))
+    try:
+        with transaction.atomic():
+            return StoredFile.objects.create(sha256=sha256, file=name, size=size)
+    except IntegrityError:
+        # Someone stored the same content concurrently; keep theirs.
+        default_storage.delete(name)
+        return StoredFile.objects.get(sha256=sha256)
+
+
+def start_upload(user, file_name, size):
+    file_name = os.path.basename(str(file_name or '')).strip()[:255]
+    if not file_name:
+        raise UploadError("File name is required.")
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError("Size must be a number of bytes.")
+    if not 0 < size <= MAX_UPLOAD_SIZE:
+        raise UploadError(f"Size must be between 1 and {MAX_UPLOAD_SIZE} bytes.")
+
+    upload = Upload.objects.create(user=user, file_name=file_name, size=size)
+    part_path(upload).touch()
+    return upload
+
+
+def get_upload(user, upload_id, lock=False):
+    queryset = Upload.objects.select_for_update() if lock else Upload.objects
+    try:
+        return queryset.get(pk=upload_id, user=user, created_at__gte=expiry_cutoff())
+    except (Upload.DoesNotExist, ValueError):
+        raise UploadNotFound("Upload not found.")
+
+
+def _check_part(upload, offset, length):
+    if upload.completed_at is not None:
+        raise UploadConflict("Upload is already complete.")
+    if offset != upload.received:
+        raise UploadConflict(f"Expected offset {upload.received}.")
+    if offset + length > upload.size:
+        raise UploadError("Part goes past the declared size.")
+
+
+def _receive(stream, length, path):
+    written = 0
+    with open(path, 'wb') as received:
+        while written < length:
+            chunk = stream.read(min(COPY_CHUNK_SIZE, length - written))
+            if not chunk:
+                break
+            received.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def write_part(user, upload_id, offset, stream, length):
+    # The part is copied from the request stream to its own file first, so
+    # neither memory use nor the database transaction depends on how fast the
+    # client sends it. Only appending it to the upload happens under the row
+    # lock, after checking no other writer got there first. Bytes received
+    # before a dropped connection still count, so the client resumes from the
+    # returned offset.
+    try:
+        offset = int(offset)
+        length = int(length)
+    except (TypeError, ValueError):
+        raise UploadError("Upload-Offset and Content-Length are required.")
+    if not 0 < length <= MAX_UPLOAD_PART_SIZE:
+        raise UploadError(f"Parts must be between 1 and {MAX_UPLOAD_PART_SIZE} bytes.")
+
+    upload = get_upload(user, upload_id)
+    _check_part(upload, offset, length)
+
+    received = _parts_dir() / f'{upload.pk}.{uuid.uuid4().hex}.receiving'
+    try:
+        written = _receive(stream, length, received)
+        if not written:
+            return upload
+        with transaction.atomic():
+            upload = get_upload(user, upload_id, lock=True)
+            _check_part(upload, offset, length)
+            with open(part_path(upload), 'r+b') as part, open(received, 'rb') as source:
+                part.seek(offset)
+                while chunk := source.read(COPY_CHUNK_SIZE):
+                    part.write(chunk)
+                part.truncate(offset + written)
+            upload.received = offset + written
+            upload.save(update_fields=['received'])
+    finally:
+        received.unlink(missing_ok=True)
+    return upload
+
+
+def complete_upload(user, upload_id, receiver):
+    # Stores the file and sends it to ``receiver`` as one message. Clients
+    # retry this after a timeout, so a completed upload returns the message
+    # it already sent.
+    with transaction.atomic():
+        upload = get_upload(user, upload_id, lock=True)
+        if upload.completed_at is None:
+            if upload.received != upload.size:
+                raise UploadConflict(f"Only {upload.received} of {upload.size} bytes were received.")
+            path = part_path(upload)
+            with open(path, 'rb') as part:
+                upload.stored_file = store_file(part)
+            upload.completed_at = timezone.now()
+            upload.save(update_fields=['stored_file', 'completed_at'])
+            transaction.on_commit(lambda: path.unlink(missing_ok=True))
+        if upload.message_id is None:
+            stored = upload.stored_file
+            upload.message = send_message(
+                user, receiver, text='', file=stored.file.name, stored_file=stored, file_name=upload.file_name,
+            )
+            upload.save(update_fields=['message'])
+        return upload.message
+
+
+def purge_expired_uploads(batch_size=PURGE_BATCH_SIZE):
+    # Deletes expired uploads, finished or not, with their part files. Rows a
+    # request still has locked are left for the next run.
+    cutoff = expiry_cutoff()
+    total = 0
+    while True:
+        with transaction.atomic():
+            expired = list(
+                Upload.objects.select_for_update(skip_locked=True).filter(created_at__lt=cutoff)
+                .only('pk')[:batch_size]
+            )
+            if not expired:
+                break
+            Upload.objects.filter(pk__in=[upload.pk for upload in expired]).delete()
+        for upload in expired:
+            part_path(upload).unlink(missing_ok=True)
+        total += len(expired)
+
+    # Parts left behind by requests that died while receiving.
+    for path in _parts_dir().glob('*.receiving'):
+        if path.stat().st_mtime < time.time() - UPLOAD_EXPIRY.total_seconds():
+            path.unlink(missing_ok=True)
+    return total
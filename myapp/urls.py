@@ -1,26 +1,67 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 from .views import transfer, TransactionListView,StatisticsView,WalletAddressView,CustomTokenObtainPairView,StartChatView ,SendMessageView, ChatListView, ChatMessagesView,SendFileView
+from django.conf import settings
 from rest_framework_simplejwt.views import TokenRefreshView
-from myapp.views import ExportTransactionsCSVView
+from myapp.views import ExportTransactionsView
 
 
-urlpatterns = [   
+sync_urlpatterns = [   
     path('login/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('register/', views.register_view, name='register'),
     path('logout/', views.logout_view, name='logout'),
     path('profile/', views.ProfileEditView.as_view(), name='profile_edit'),
     path('wallet/transfer/', transfer, name='transfer'),
+    path('wallet/transfer/batch/', views.batch_transfer, name='batch_transfer'),
     path('wallet/transactions/', TransactionListView.as_view(), name='transactions'),
     path('statistics/', StatisticsView.as_view(), name='statistics'),
+    path('cache/stats/', views.CacheStatsView.as_view(), name='cache_stats'),
     path('wallet/address/', WalletAddressView.as_view(), name='wallet-address'),
     path('wallet/deposit/', views.deposit, name='deposit'),
     path('wallet/balance/', views.check_balance, name='check_balance'),
-    path('wallet/export/csv/', ExportTransactionsCSVView.as_view(), name='export_transactions_csv'),
+    path('wallet/analytics/', views.WalletAnalyticsView.as_view(), name='wallet_analytics'),
+    path('wallet/balance/history/', views.balance_history, name='balance_history'),
+    path('wallet/events/', async_views.wallet_events, name='wallet_events'),
+    path('wallet/export/csv/', ExportTransactionsView.as_view(), name='export_transactions_csv'),
+    path('wallet/export/<str:export_format>/', ExportTransactionsView.as_view(), name='export_transactions'),
     path('messages/start_chat/', StartChatView.as_view(), name='start_chat'),
     path('messages/send/', SendMessageView.as_view(), name='send_message'),
     path('messages/send-file/<str:wallet_address>/', SendFileView.as_view(), name='send_file'), 
+    path('messages/uploads/', views.UploadStartView.as_view(), name='upload_start'),
+    path('messages/uploads/<uuid:upload_id>/', views.UploadPartView.as_view(), name='upload_part'),
+    path('messages/uploads/<uuid:upload_id>/complete/', views.UploadCompleteView.as_view(), name='upload_complete'),
+    path('messages/file/<int:message_id>/', views.MessageFileView.as_view(), name='message_file'),
     path('messages/chats/', ChatListView.as_view(), name='chat_list'),
     path('messages/chat/<str:wallet_address>/', ChatMessagesView.as_view(), name='chat_messages'),
 ]
+
+# Under ASGI the read-heavy endpoints can be served by native async views that
+# wait on the database without holding a worker thread (see myproject/asgi.py).
+async_read_views = {
+    'transactions': async_views.transaction_list,
+    'wallet-address': async_views.wallet_address,
+    'check_balance': async_views.check_balance,
+    'chat_list': async_views.chat_list,
+}
+
+# Login awaits password verification from the event loop instead of queueing
+# on the one thread sync views share under ASGI.
+async_views_by_name = {
+    **async_read_views,
+    'token_obtain_pair': async_views.token_obtain_pair,
+}
+
+
+def with_async_views(patterns):
+    return [
+        path(str(pattern.pattern), async_views_by_name[pattern.name], name=pattern.name)
+        if pattern.name in async_views_by_name else pattern
+        for pattern in patterns
+    ]
+
+
+if getattr(settings, 'ASYNC_READ_VIEWS', False):
+    urlpatterns = with_async_views(sync_urlpatterns)
+else:
+    urlpatterns = sync_urlpatterns
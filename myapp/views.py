@@ -4,26 +4,41 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from .serializers import LoginSerializer,ProfileSerializer ,ProfileEditSerializer,MessageSerializer, ChatListSerializer
 from rest_framework.decorators import api_view, permission_classes,authentication_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from .models import Wallet, Transaction, Message 
-from decimal import Decimal
 from .serializers import TransactionSerializer
-from django.utils.dateparse import parse_date
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.db.models import Sum
 from django.contrib.auth.models import User
 import uuid
 from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
-import csv
-from django.http import HttpResponse 
+from .tokens import WalletRefreshToken, revoke_token
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from .filters import TransactionFilter
+from .pagination import KeysetPagination, decode_cursor, encode_cursor, keyset_before
+from .exports import EXPORT_FORMATS, export_rows
+from .caching import cache_stats, get_user_by_address, get_wallet_snapshot
+from .analytics import DEFAULT_TOP_COUNTERPARTIES, MAX_TOP_COUNTERPARTIES, wallet_analytics
+from .idempotency import idempotent
+from .downloads import file_response, variant_file
+from .ledger import balance_as_of
+from .previews import PREVIEW_SIZES
+from .uploads import (
+    MAX_UPLOAD_PART_SIZE, UPLOAD_EXPIRY, UploadError, complete_upload, get_upload, start_upload, store_file, write_part,
+)
+from .conversations import conversation_list, mark_messages_read, send_message
+from .stats import live_statistics, parse_windows, pending_statistics, rollup_statistics
+from . import services
+from .services import deposit_funds, transfer_funds, TransferError, BatchTransferError
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from rest_framework.parsers import MultiPartParser, FormParser,JSONParser
-from django.db.models import Q, Count, Max
+from django.db.models import Q
 from django.utils.timezone import now
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 @api_view(['POST'])
 def login_view(request):
@@ -61,7 +76,7 @@ def register_view(request):
         wallet = Wallet.objects.create(user=user, address=uuid.uuid4())  
         wallet.save()
 
-    refresh = RefreshToken.for_user(user)
+    refresh = WalletRefreshToken.for_user(user)
     access_token = str(refresh.access_token)
 
     return Response({
@@ -73,6 +88,15 @@ def register_view(request):
 
 @api_view(['POST'])
 def logout_view(request):
+    # Tokens are not looked up per request, so logging out denylists them
+    # until they would have expired anyway.
+    if request.auth is not None:
+        revoke_token(request.auth)
+    if request.data.get('refresh'):
+        try:
+            revoke_token(RefreshToken(request.data['refresh']))
+        except TokenError:
+            pass
     logout(request)
     return Response({"message": "Logged out successfully"})
 
@@ -105,6 +129,7 @@ def profile_edit(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def transfer(request):
     receiver_address = request.data.get('receiver_address')
     amount = request.data.get('amount')
@@ -112,127 +137,81 @@ def transfer(request):
     if not receiver_address or not amount:
         return Response({"error": "Receiver address and amount are required."}, status=status.HTTP_400_BAD_REQUEST)
 
-    amount = Decimal(amount)
-    sender_wallet = request.user.wallet
-
-    if sender_wallet.balance < amount:
-        return Response({"error": "Insufficient balance."}, status=status.HTTP_400_BAD_REQUEST)
-
     try:
-        receiver_wallet = Wallet.objects.get(address=receiver_address)
-    except Wallet.DoesNotExist:
-        return Response({"error": "Receiver wallet not found."}, status=status.HTTP_404_NOT_FOUND)
-
-    sender_wallet.balance -= amount
-    receiver_wallet.balance += amount
-
-    sender_wallet.save()
-    receiver_wallet.save()
-
-    Transaction.objects.create(
-        wallet=sender_wallet,
-        sender=sender_wallet,
-        receiver=receiver_wallet,
-        transaction_type='transfer',
-        amount=amount
-    )
-
-    Transaction.objects.create(
-        wallet=receiver_wallet,
-        sender=sender_wallet,
-        receiver=receiver_wallet,
-        transaction_type='receive',
-        amount=amount
-    )
+        transfer_funds(request.user, receiver_address, amount)
+    except TransferError as e:
+        return Response({"error": str(e)}, status=e.status_code)
 
     return Response({"message": "Transfer successful."}, status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent
+def batch_transfer(request):
+    transfers = request.data.get('transfers')
 
-class TransactionListView(generics.ListAPIView):
-    serializer_class = TransactionSerializer
-    permission_classes = [IsAuthenticated]
+    try:
+        sender_wallet, total, results = services.batch_transfer(request.user, transfers)
+    except BatchTransferError as e:
+        return Response({"error": str(e), "results": e.results}, status=e.status_code)
+    except TransferError as e:
+        return Response({"error": str(e)}, status=e.status_code)
+
+    return Response({
+        "message": "Batch transfer successful.",
+        "total_amount": str(total),
+        "new_balance": str(sender_wallet.balance),
+        "results": results,
+    }, status=status.HTTP_200_OK)
 
-    def get_queryset(self):
-        queryset = Transaction.objects.filter(wallet=self.request.user.wallet)
-        start_date = self.request.query_params.get("start_date")
-        end_date = self.request.query_params.get("end_date")
-        min_amount = self.request.query_params.get("min_amount")
-        max_amount = self.request.query_params.get("max_amount")
-        username = self.request.query_params.get("username")
-
-        if start_date:
-            queryset = queryset.filter(timestamp__gte=parse_date(start_date))
-        if end_date:
-            queryset = queryset.filter(timestamp__lte=parse_date(end_date))
-        if min_amount:
-            queryset = queryset.filter(amount__gte=min_amount)
-        if max_amount:
-            queryset = queryset.filter(amount__lte=max_amount)
-        if username:
-            queryset = queryset.filter(sender__user__username=username) | queryset.filter(receiver__user__username=username)
-
-        return queryset
 
 
 class WalletAddressView(APIView):
     permission_classes = [IsAuthenticated] 
     def get(self, request):
+        # Addresses never change, so the one carried by the token is used as is.
         try:
-            wallet = Wallet.objects.get(user=request.user)
-            return Response({"wallet_address": str(wallet.address)}, status=status.HTTP_200_OK)
+            address = request.user.wallet.address
         except Wallet.DoesNotExist:
             return Response({"error": "Wallet not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"wallet_address": str(address)}, status=status.HTTP_200_OK)
 
 class StatisticsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        transaction_count_week = Transaction.objects.filter(timestamp__gte='2025-03-01').count()
-        transaction_count_month = Transaction.objects.filter(timestamp__gte='2025-02-01').count()
-        transaction_count_year = Transaction.objects.filter(timestamp__gte='2024-03-01').count()
-
-        transaction_volume_week = Transaction.objects.filter(timestamp__gte='2025-03-01').aggregate(Sum('amount'))
-        transaction_volume_month = Transaction.objects.filter(timestamp__gte='2025-02-01').aggregate(Sum('amount'))
-        transaction_volume_year = Transaction.objects.filter(timestamp__gte='2024-03-01').aggregate(Sum('amount'))
-
-        message_count_week = Message.objects.filter(timestamp__gte='2025-03-01').count()
-        message_count_month = Message.objects.filter(timestamp__gte='2025-02-01').count()
-        message_count_year = Message.objects.filter(timestamp__gte='2024-03-01').count()
-
-        statistics = {
-            'transaction_count_week': transaction_count_week,
-            'transaction_count_month': transaction_count_month,
-            'transaction_count_year': transaction_count_year,
-            'transaction_volume_week': transaction_volume_week['amount__sum'] or 0,
-            'transaction_volume_month': transaction_volume_month['amount__sum'] or 0,
-            'transaction_volume_year': transaction_volume_year['amount__sum'] or 0,
-            'message_count_week': message_count_week,
-            'message_count_month': message_count_month,
-            'message_count_year': message_count_year,
-        }
-
-        return Response(statistics)
+        try:
+            windows = parse_windows(request.query_params.get('windows'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        scope = request.query_params.get('scope', 'all')
+        source = request.query_params.get('source', 'rollup')
+        if scope not in ('all', 'me'):
+            return Response({"error": "scope must be 'all' or 'me'."}, status=status.HTTP_400_BAD_REQUEST)
+        if source not in ('rollup', 'live'):
+            return Response({"error": "source must be 'rollup' or 'live'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Rollups are global, so per-user statistics are always computed live.
+        if scope == 'me':
+            return Response(live_statistics(windows, user=request.user))
+        if source == 'live':
+            return Response(live_statistics(windows))
+        # Rollups trail the live numbers by the increments still queued.
+        return Response({**rollup_statistics(windows), **pending_statistics()})
     
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def deposit(request):
     amount = request.data.get('amount')
 
-    if not amount or float(amount) <= 0:
-        return Response({"error": "Invalid amount."}, status=status.HTTP_400_BAD_REQUEST)
-
-    wallet = request.user.wallet
-    amount = Decimal(amount)
-
-    wallet.balance += amount
-    wallet.save()
-    Transaction.objects.create(
-        wallet=wallet,
-        transaction_type='deposit',
-        amount=amount
-    )
+    try:
+        wallet = deposit_funds(request.user, amount)
+    except TransferError as e:
+        return Response({"error": str(e)}, status=e.status_code)
 
     return Response({"message": "Deposit successful.", "new_balance": wallet.balance}, status=status.HTTP_200_OK)
     
@@ -240,17 +219,35 @@ def deposit(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated]) 
 def check_balance(request):
-    user = request.user 
+    wallet = get_wallet_snapshot(request.user.pk)
+    if wallet is None:
+        return Response({"error": "Wallet not found."}, status=404)
+    return Response({"balance": str(wallet['balance'])}, status=200)
+
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def balance_history(request):
     try:
-        wallet = Wallet.objects.get(user=user)
-        
-        return Response({"balance": str(wallet.balance)}, status=200)
-    
-    except Wallet.DoesNotExist:
-        return Response({"error": "Wallet not found."}, status=404)
+        at = parse_datetime(request.query_params.get('at', ''))
+    except ValueError:
+        at = None
+    if at is None:
+        return Response({"error": "'at' must be an ISO date/time."}, status=status.HTTP_400_BAD_REQUEST)
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
+
+    wallet = request.user.wallet
+    return Response({"balance": str(balance_as_of(wallet, at)), "at": at}, status=status.HTTP_200_OK)
     
 
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(cache_stats())
+
+
 class CustomTokenObtainPairView(TokenObtainPairView):
     def post(self, request, *args, **kwargs):
         if request.content_type != 'application/json':
@@ -258,24 +255,53 @@ class CustomTokenObtainPairView(TokenObtainPairView):
         return super().post(request, *args, **kwargs)
     
 
-class ExportTransactionsCSVView(APIView):
+class ExportTransactionsView(APIView):
     permission_classes = [IsAuthenticated]
 
     @method_decorator(csrf_exempt)
-    def get(self, request):
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="transactions.csv"'
+    def get(self, request, export_format='csv'):
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": "Unsupported export format."}, status=status.HTTP_404_NOT_FOUND)
+
+        queryset = Transaction.objects.filter(wallet=request.user.wallet)
+        filterset = TransactionFilter(request.query_params, queryset=queryset)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        stream, content_type, filename = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(stream(export_rows(filterset.qs)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         response['Access-Control-Allow-Origin'] = request.headers.get('Origin', '*')
         response['Access-Control-Allow-Credentials'] = 'true'
 
-        writer = csv.writer(response)
-        writer.writerow(['ID', 'Wallet', 'Sender', 'Receiver', 'Type', 'Amount', 'Timestamp'])
+        return response
 
-        transactions = Transaction.objects.filter(wallet__user=request.user)
-        for tx in transactions:
-            writer.writerow([tx.id, tx.wallet.address, tx.sender, tx.receiver, tx.transaction_type, tx.amount, tx.timestamp])
+class WalletAnalyticsView(APIView):
+    permission_classes = [IsAuthenticated]
 
-        return response
+    @staticmethod
+    def _date(request, name):
+        value = request.query_params.get(name)
+        if not value:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise ValueError(value)
+        return parsed
+
+    def get(self, request):
+        try:
+            start_date = self._date(request, 'start_date')
+            end_date = self._date(request, 'end_date')
+            top = int(request.query_params.get('top', DEFAULT_TOP_COUNTERPARTIES))
+        except ValueError:
+            return Response({"error": "Dates must be YYYY-MM-DD and top a number."}, status=status.HTTP_400_BAD_REQUEST)
+        if start_date and end_date and start_date > end_date:
+            return Response({"error": "start_date must not be after end_date."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < top <= MAX_TOP_COUNTERPARTIES:
+            return Response({"error": f"top must be between 1 and {MAX_TOP_COUNTERPARTIES}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(wallet_analytics(request.user.wallet, start_date, end_date, top))
 
 class TransactionListView(generics.ListAPIView):
     queryset = Transaction.objects.all()
@@ -283,9 +309,11 @@ class TransactionListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_class = TransactionFilter
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Transaction.objects.filter(wallet=self.request.user.wallet)
+        return Transaction.objects.filter(wallet=self.request.user.wallet) \
+            .select_related('sender__user', 'receiver__user')
     
 class StartChatView(APIView):
     permission_classes = [IsAuthenticated]
@@ -293,14 +321,13 @@ class StartChatView(APIView):
     def post(self, request):
         receiver_wallet = request.data.get("receiver_wallet")
         
-        try:
-            receiver = Wallet.objects.get(address=receiver_wallet).user
-        except Wallet.DoesNotExist:
+        receiver = get_user_by_address(receiver_wallet)
+        if receiver is None:
             return Response({"error": "Receiver wallet address not found"}, status=400)
 
-        Message.objects.create(
-            sender=request.user,
-            receiver=receiver,
+        send_message(
+            request.user,
+            receiver,
             text="",
             timestamp=now(),
             is_read=False 
@@ -321,12 +348,11 @@ class SendMessageView(APIView):
         receiver_wallet = request.data.get('receiver_wallet')
         text = request.data.get('text', '')
 
-        try:
-            receiver = Wallet.objects.get(address=receiver_wallet).user
-        except Wallet.DoesNotExist:
+        receiver = get_user_by_address(receiver_wallet)
+        if receiver is None:
             return Response({"error": "Receiver wallet address not found"}, status=400)
 
-        message = Message.objects.create(sender=request.user, receiver=receiver, text=text)
+        message = send_message(request.user, receiver, text=text)
         return Response(MessageSerializer(message).data, status=201)
 
     
@@ -336,63 +362,170 @@ class SendFileView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def post(self, request, wallet_address):
-        try:
-            receiver = Wallet.objects.get(address=wallet_address).user
-        except Wallet.DoesNotExist:
+        receiver = get_user_by_address(wallet_address)
+        if receiver is None:
             return Response({"error": "Receiver wallet address not found"}, status=404)
 
         file = request.FILES.get('file')
         if not file:
             return Response({"error": "No file provided"}, status=400)
 
-        message = Message.objects.create(sender=request.user, receiver=receiver, text='', file=file)
+        # Identical content is stored once and shared between messages.
+        stored = store_file(file)
+        message = send_message(
+            request.user, receiver, text='', file=stored.file.name, stored_file=stored, file_name=file.name[:255],
+        )
         return Response(MessageSerializer(message).data, status=201)
 
-class ChatListView(APIView):
+
+def _upload_state(upload):
+    return {
+        "upload_id": str(upload.pk),
+        "file_name": upload.file_name,
+        "size": upload.size,
+        "received": upload.received,
+        "complete": upload.completed_at is not None,
+        "max_part_size": MAX_UPLOAD_PART_SIZE,
+        "expires_at": upload.created_at + UPLOAD_EXPIRY,
+    }
+
+
+class UploadStartView(APIView):
     permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser]
 
-    def get(self, request):
-        chats = Message.objects.filter(Q(sender=request.user) | Q(receiver=request.user)) \
-            .values('receiver__wallet__address', 'sender__wallet__address') \
-            .annotate(
-                last_message=Max('text'),
-                timestamp=Max('timestamp'),
-                unread_count=Count('id', filter=Q(receiver=request.user, is_read=False))
+    def post(self, request):
+        try:
+            upload = start_upload(request.user, request.data.get('file_name'), request.data.get('size'))
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        return Response(_upload_state(upload), status=201)
+
+
+class UploadPartView(APIView):
+    # GET reports how many bytes arrived, so an interrupted client knows where
+    # to resume; PUT appends the raw request body at Upload-Offset.
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        try:
+            upload = get_upload(request.user, upload_id)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        return Response(_upload_state(upload))
+
+    def put(self, request, upload_id):
+        try:
+            upload = write_part(
+                request.user,
+                upload_id,
+                request.headers.get('Upload-Offset'),
+                request.stream,
+                request.META.get('CONTENT_LENGTH'),
             )
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        return Response(_upload_state(upload))
+
+
+class UploadCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser]
+
+    def post(self, request, upload_id):
+        receiver = get_user_by_address(request.data.get('receiver_wallet'))
+        if receiver is None:
+            return Response({"error": "Receiver wallet address not found"}, status=404)
+        try:
+            message = complete_upload(request.user, upload_id, receiver)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        return Response(MessageSerializer(message).data, status=201)
+
+class MessageFileView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, message_id):
+        # Only the two participants can fetch an attachment or its previews;
+        # anyone else gets the same 404 as for a missing message.
+        variant = request.query_params.get('variant')
+        if variant is not None and variant not in PREVIEW_SIZES:
+            return Response({"error": "Invalid variant"}, status=400)
+        message = Message.objects.select_related('stored_file') \
+            .filter(Q(sender=request.user) | Q(receiver=request.user), pk=message_id) \
+            .first()
+        if message is None or not message.file or not variant_file(message, variant):
+            return Response({"error": "File not found"}, status=404)
+        return file_response(request, message, variant)
+
+class ChatListView(APIView):
+    permission_classes = [IsAuthenticated]
 
-        chat_list = []
-        for chat in chats:
-            if chat["receiver__wallet__address"] == request.user.wallet.address:
-                wallet_address = chat["sender__wallet__address"]
-                user = Wallet.objects.get(address=wallet_address).user
-            else:
-                wallet_address = chat["receiver__wallet__address"]
-                user = Wallet.objects.get(address=wallet_address).user
-
-            chat_list.append({
-                "wallet_address": wallet_address,
-                "username": user.username, 
-                "last_message": chat["last_message"],
-                "timestamp": chat["timestamp"],
-                "unread_count": chat["unread_count"]
-            })
-
-        return Response(chat_list)
+    def get(self, request):
+        return Response(conversation_list(request.user))
 
 class ChatMessagesView(APIView):
     permission_classes = [IsAuthenticated]
+    page_size = 50
+    max_page_size = 200
 
     def get(self, request, wallet_address):
-        try:
-            chat_user = Wallet.objects.get(address=wallet_address).user
-        except Wallet.DoesNotExist:
+        chat_user = get_user_by_address(wallet_address)
+        if chat_user is None:
             return Response({"error": "User not found"}, status=404)
 
         messages = Message.objects.filter(
             (Q(sender=request.user) & Q(receiver=chat_user)) |
             (Q(sender=chat_user) & Q(receiver=request.user))
-        ).order_by('timestamp')
+        ).select_related('sender__wallet', 'receiver__wallet')
 
-        messages.filter(receiver=request.user).update(is_read=True)
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+        limit = request.query_params.get('limit')
 
-        return Response(MessageSerializer(messages, many=True).data)
\ No newline at end of file
+        if not (before or after or limit):
+            page = list(messages.order_by('timestamp', 'id'))
+            mark_messages_read(request.user, chat_user, page)
+            return Response(MessageSerializer(page, many=True).data)
+
+        try:
+            limit = min(int(limit), self.max_page_size) if limit else self.page_size
+            if limit <= 0:
+                raise ValueError
+        except ValueError:
+            return Response({"error": "Invalid limit."}, status=400)
+
+        if after:
+            # Incremental sync: everything newer than the last id the client has.
+            try:
+                after = int(after)
+            except ValueError:
+                return Response({"error": "Invalid after id."}, status=400)
+            page = list(messages.filter(id__gt=after).order_by('id')[:limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit]
+        else:
+            # Scroll back: the newest page older than the cursor, returned ascending.
+            queryset = messages.order_by('-timestamp', '-id')
+            if before:
+                try:
+                    timestamp, pk = decode_cursor(before)
+                except ValueError:
+                    return Response({"error": "Invalid cursor."}, status=400)
+                queryset = keyset_before(queryset, timestamp, pk)
+            page = list(queryset[:limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit][::-1]
+
+        mark_messages_read(request.user, chat_user, page)
+
+        previous_cursor = None
+        if page and not after and has_more:
+            previous_cursor = encode_cursor(page[0].timestamp, page[0].pk)
+
+        return Response({
+            "results": MessageSerializer(page, many=True).data,
+            "has_more": has_more,
+            "previous_cursor": previous_cursor,
+            "last_id": page[-1].pk if page else after,
+        })
@@ -0,0 +1,71 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .realtime import get_broker, user_topic
+from .tokens import ais_revoked
+
+WEBSOCKET_PATH = '/ws/events/'
+
+
+async def authenticate_websocket(scope):
+    query = parse_qs(scope.get('query_string', b'').decode())
+    token = query.get('token', [None])[0]
+    if not token:
+        return None
+    try:
+        access_token = AccessToken(token)
+        user_id = access_token[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+    if await ais_revoked(access_token):
+        return None
+    if not await User.objects.filter(pk=user_id, is_active=True).aexists():
+        return None
+    return user_id
+
+
+def _frame(event):
+    return {'type': 'websocket.send', 'text': json.dumps(event, cls=DjangoJSONEncoder)}
+
+
+async def websocket_application(scope, receive, send):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if scope['path'] != WEBSOCKET_PATH:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    user_id = await authenticate_websocket(scope)
+    if user_id is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+
+    await send({'type': 'websocket.accept'})
+
+    broker = get_broker()
+    topic = user_topic(user_id)
+    queue = broker.subscribe(topic)
+    incoming = asyncio.ensure_future(receive())
+    outgoing = asyncio.ensure_future(queue.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait({incoming, outgoing}, return_when=asyncio.FIRST_COMPLETED)
+            if incoming in done:
+                message = incoming.result()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message.get('text') == 'ping':
+                    await send(_frame({"type": "pong"}))
+                incoming = asyncio.ensure_future(receive())
+            if outgoing in done:
+                await send(_frame(outgoing.result()))
+                outgoing = asyncio.ensure_future(queue.get())
+    finally:
+        incoming.cancel()
+        outgoing.cancel()
+        broker.unsubscribe(topic, queue)
@@ -5,6 +5,39 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+Deployment profile for high-concurrency reads:
+
+    ASYNC_READ_VIEWS = True  (settings)
+    uvicorn myproject.asgi:application --workers <cores> --no-access-log
+
+With ASYNC_READ_VIEWS enabled, wallet/balance/, wallet/address/,
+wallet/transactions/ and messages/chats/ are served by the async views in
+myapp/async_views.py, login/ awaits the PASSWORD_VERIFY_WORKERS pool from the
+event loop (set it above 0 so hashing leaves the server process), and
+wallet/events/ plus the /ws/events/ WebSocket keep idle connections on the
+event loop instead of a thread each. Keep CONN_MAX_AGE at 0 (or put PgBouncer
+in front of Postgres) since async ORM calls may run on different threads
+across requests.
+
+Whichever server runs the app, background jobs (statistics rollups,
+attachment previews) need worker processes alongside it:
+
+    python manage.py run_workers --concurrency <n>
+
+Without them the jobs only pile up: statistics/ keeps serving old rollups
+(its pending_updates and pending_since fields show the backlog) and
+attachments never get metadata or previews.
+
+Measure before switching, against the production database:
+
+    python manage.py benchmark_servers --threads <n> --concurrency <n>
+
+reports requests per second and p50/p99 latency for each of those endpoints,
+served by the sync views on WSGI threads and by the async views on an event
+loop (myapp/management/commands/benchmark_servers.py). Async ORM queries run
+on one shared thread, so the async views only pay off when requests spend
+their time waiting (slow network to the database, long-lived connections).
 """
 
 import os
@@ -13,4 +46,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from myapp.websocket import websocket_application
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -116,13 +116,35 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# The first hasher is used for new passwords; the others only verify existing
+# hashes, which are upgraded on the user's next login. Tune the costs with
+# `manage.py benchmark_hashers` against the login latency budget.
+PASSWORD_HASHERS = [
+    'myapp.hashers.TunableArgon2PasswordHasher',
+    'myapp.hashers.TunableBCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+PASSWORD_HASHER_OPTIONS = {
+    'argon2': {'time_cost': 2, 'memory_cost': 19456, 'parallelism': 1},
+    'bcrypt_sha256': {'rounds': 12},
+}
+
+AUTHENTICATION_BACKENDS = ['myapp.backends.PooledModelBackend']
+
+# Processes that verify passwords off the request thread; 0 verifies inline,
+# -1 starts one per core.
+PASSWORD_VERIFY_WORKERS = 0
+
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'myapp.authentication.StatelessJWTAuthentication',
     ],
 }
 
@@ -131,8 +153,19 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=365),
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': False,
+    'TOKEN_OBTAIN_SERIALIZER': 'myapp.tokens.WalletTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'myapp.tokens.DenylistTokenRefreshSerializer',
 }
 
+# Pub/sub used for WebSocket pushes. The default only reaches connections held
+# by the same process; point this at another broker class to fan out further.
+REALTIME_BROKER = 'myapp.realtime.InProcessBroker'
+
+# Serve the balance, wallet address, transaction history and chat list
+# endpoints, and login, from async views. Only worth enabling under an ASGI
+# server.
+ASYNC_READ_VIEWS = False
+
 CORS_ALLOW_CREDENTIALS = True  
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000", 
@@ -145,6 +178,35 @@ CORS_ALLOWED_ORIGINS = [
     "https://coinmeme.liara.run", 
 ]
 
+# Wallet and address lookups are cached in WALLET_CACHE_ALIAS (see
+# myapp/caching.py). The local-memory backend is an LRU private to each process
+# that other workers cannot invalidate, so with it only the immutable address ->
+# wallet/user ids mapping is cached; balances and usernames are always read from
+# the database. A deleted wallet can still resolve in other workers for up to
+# WALLET_CACHE_TIMEOUT (300s). Point this alias at a shared backend such as
+# Redis or Memcached to cache balances and usernames as well.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'wallets': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'wallets',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Revoked token ids, checked on every request. Entries must not be culled
+    # before they expire, and every worker has to see them: use a shared
+    # backend when running more than one process.
+    'tokens': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tokens',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
+WALLET_CACHE_ALIAS = 'wallets'
+TOKEN_DENYLIST_CACHE_ALIAS = 'tokens'
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -162,6 +224,15 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Chunked uploads are assembled here before being moved into file storage.
+UPLOAD_PARTS_DIR = BASE_DIR / 'upload_parts'
+
+# Attachment downloads are streamed by Django unless offloaded to the front-end
+# server: 'x-accel-redirect' (nginx, internal location at the prefix below
+# aliased to MEDIA_ROOT) or 'x-sendfile' (Apache/lighttpd).
+FILE_DOWNLOAD_OFFLOAD = None
+FILE_DOWNLOAD_ACCEL_PREFIX = '/protected-media/'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -5,6 +5,9 @@ It exposes the WSGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
+
+Background jobs also need `python manage.py run_workers` running alongside
+the server; see myproject/asgi.py.
 """
 
 import os